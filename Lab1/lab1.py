@@ -1,4 +1,8 @@
+import contextlib
 import json
+import multiprocessing
+import os
+import queue
 from abc import abstractmethod, ABC
 import time
 from queue import PriorityQueue
@@ -11,6 +15,7 @@ class Problema:
         with open(problema_json, 'r') as f:
             ciudad = json.load(f)
         # Inicializamos los datos del problema y los almacenamos en variables
+        self.archivo = problema_json
         self.filas = ciudad['city']['rows']
         self.columnas = ciudad['city']['columns']
         self.inicio = Nodo(Estado(ciudad['departure'][0], ciudad['departure'][1]))
@@ -107,6 +112,146 @@ class Problema:
             AEstrella(problema).iniciar_busqueda(persona_rescate)
         self.estadisticas_globales()
 
+    # Portfolio de algoritmos: para cada persona se lanzan a la vez las búsquedas de todos los algoritmos, cada una en su
+    # propio proceso. Se queda con el primer resultado aceptable (ver es_resultado_aceptable) y termina el resto de
+    # procesos en ese momento. Si ninguno es aceptable se queda con el de menor coste
+    # Las victorias de cada algoritmo se añaden a archivo_estadisticas para elegir después el mejor por perfil de mapa
+    def resolver_portfolio(self, nodos_rescate, algoritmos=None, cota_coste=None, archivo_estadisticas=None):
+        print("---PORTFOLIO DE ALGORITMOS---")
+        algoritmos = list(algoritmos_portfolio) if algoritmos is None else algoritmos
+        victorias = dict.fromkeys(algoritmos, 0)
+        for persona_rescate in nodos_rescate:
+            print("Rescuing person at position:", (persona_rescate.estado.fila, persona_rescate.estado.columna))
+            print("-----------------------------------")
+            ganador = self.carrera(persona_rescate, algoritmos, cota_coste)
+            if ganador is None:
+                print("No se ha podido acceder a la persona")
+                print(" ")
+                continue
+            victorias[ganador['algoritmo']] += 1
+            print("Winner algorithm:", ganador['algoritmo'])
+            print("Generated nodes:", ganador['nodos_generados'])
+            print("Expanded nodes:", ganador['nodos_expandidos'])
+            print("Execution time:", ganador['tiempo'])
+            print("Solution length:", len(ganador['camino']))
+            print("Solution cost:", ganador['coste'])
+            print("Solution:", ganador['camino'])
+            print(" ")
+            self.personas_rescatadas += 1
+            self.media_nodos_generados += ganador['nodos_generados']
+            self.media_nodos_expandidos += ganador['nodos_expandidos']
+            self.media_tiempo_ejecucion += ganador['tiempo']
+            self.media_tamaño_solucion += len(ganador['camino'])
+            self.media_coste_solucion += ganador['coste']
+        print("Wins:", victorias)
+        if archivo_estadisticas is not None:
+            self.registrar_victorias(archivo_estadisticas, victorias)
+        self.estadisticas_globales()
+        return victorias
+
+    # Carrera entre algoritmos para una persona, el tiempo del resultado es el de la carrera desde que se lanza
+    # Cada intervalo segundos sin resultados se comprueba si algún proceso ha muerto para no esperar indefinidamente
+    def carrera(self, rescate, algoritmos, cota_coste=None, intervalo=1.0):
+        cola = multiprocessing.Queue()
+        procesos = [multiprocessing.Process(target=busqueda_portfolio, args=(self, nombre, rescate, cola), daemon=True)
+                    for nombre in algoritmos]
+        iniciar_temporizador = time.perf_counter()
+        for proceso in procesos:
+            proceso.start()
+        ganador = None
+        mejor = None
+        pendientes = dict(zip(algoritmos, procesos))
+        try:
+            while pendientes and ganador is None:
+                try:
+                    mensajes = [cola.get(timeout=intervalo)]
+                except queue.Empty:
+                    # Un proceso muerto sin haber enviado su resultado (p. ej. eliminado por falta de memoria)
+                    # cuenta como una búsqueda sin solución. Primero se miran los procesos muertos y después se vacía
+                    # la cola: los que terminan bien vuelcan su resultado antes de salir, así que ya está en ella
+                    muertos = [nombre for nombre, proceso in pendientes.items() if not proceso.is_alive()]
+                    mensajes = []
+                    with contextlib.suppress(queue.Empty):
+                        while True:
+                            mensajes.append(cola.get_nowait())
+                    recibidos = {nombre for nombre, _ in mensajes}
+                    for nombre in muertos:
+                        if nombre not in recibidos:
+                            print(f"{nombre} terminated unexpectedly (exit code {pendientes[nombre].exitcode})")
+                            del pendientes[nombre]
+                for nombre, resultado in mensajes:
+                    pendientes.pop(nombre, None)
+                    if resultado is None:
+                        continue
+                    resultado['algoritmo'] = nombre
+                    resultado['tiempo'] = time.perf_counter() - iniciar_temporizador
+                    if mejor is None or resultado['coste'] < mejor['coste']:
+                        mejor = resultado
+                    if self.es_resultado_aceptable(nombre, resultado, rescate, cota_coste):
+                        ganador = resultado
+                        break
+        finally:
+            # Cancelamos las búsquedas que siguen en marcha
+            for proceso in procesos:
+                if proceso.is_alive():
+                    proceso.terminate()
+                proceso.join()
+        return ganador if ganador is not None else mejor
+
+    # Un resultado es aceptable si es óptimo o si su coste no supera cota_coste. Es óptimo si viene de A* (la distancia
+    # de Manhattan es admisible y consistente), de anchura cuando no hay peligros (todas las acciones cuestan 1)
+    # o si su coste es igual a la distancia de Manhattan, que es una cota inferior del coste de cualquier camino
+    def es_resultado_aceptable(self, nombre, resultado, rescate, cota_coste=None):
+        if nombre == 'a_estrella' or (nombre == 'anchura' and not self.peligros):
+            return True
+        if resultado['coste'] == self.heuristica_manhattan(self.inicio, rescate):
+            return True
+        return cota_coste is not None and resultado['coste'] <= cota_coste
+
+    # Perfil del mapa con el que se agrupan las victorias: tamaño, densidad de bloqueos y si tiene peligros
+    def perfil_mapa(self):
+        celdas = self.filas * self.columnas
+        tamaño = 'pequeño' if celdas <= 1000 else 'mediano' if celdas <= 100000 else 'grande'
+        densidad = 'denso' if len(self.bloqueados) / celdas > 0.2 else 'abierto'
+        peligros = 'con_peligros' if self.peligros else 'sin_peligros'
+        return f"{tamaño}-{densidad}-{peligros}"
+
+    # Añade las victorias de una ejecución del portfolio al json de estadísticas, agrupadas por instancia
+    def registrar_victorias(self, archivo_estadisticas, victorias):
+        estadisticas = {}
+        if os.path.exists(archivo_estadisticas):
+            with open(archivo_estadisticas, 'r') as f:
+                estadisticas = json.load(f)
+        instancia = estadisticas.setdefault(os.path.basename(self.archivo), {'perfil': self.perfil_mapa(),
+                                                                             'victorias': {}})
+        for nombre, numero in victorias.items():
+            instancia['victorias'][nombre] = instancia['victorias'].get(nombre, 0) + numero
+        with open(archivo_estadisticas, 'w') as f:
+            json.dump(estadisticas, f, indent=4)
+
+    # Algoritmo con más victorias en las instancias del mismo perfil de mapa, por_defecto si aún no hay ninguna
+    def mejor_algoritmo(self, archivo_estadisticas, por_defecto='a_estrella'):
+        if not os.path.exists(archivo_estadisticas):
+            return por_defecto
+        with open(archivo_estadisticas, 'r') as f:
+            estadisticas = json.load(f)
+        victorias = {}
+        for instancia in estadisticas.values():
+            if instancia['perfil'] == self.perfil_mapa():
+                for nombre, numero in instancia['victorias'].items():
+                    victorias[nombre] = victorias.get(nombre, 0) + numero
+        if not any(victorias.values()):
+            return por_defecto
+        return max(victorias, key=victorias.get)
+
+    # Resuelve con el mejor algoritmo para el perfil del mapa según las estadísticas del portfolio
+    def resolver_mejor_algoritmo(self, nodos_rescate, archivo_estadisticas):
+        nombre = self.mejor_algoritmo(archivo_estadisticas)
+        print("---MEJOR ALGORITMO PARA EL PERFIL", self.perfil_mapa(), ":", nombre, "---")
+        for persona_rescate in nodos_rescate:
+            algoritmos_portfolio[nombre](self).iniciar_busqueda(persona_rescate)
+        self.estadisticas_globales()
+
 
 # Clase en la que definimos el estado
 class Estado:
@@ -279,6 +424,7 @@ class Search(ABC):
         return camino
 
     # Generamos las estadísticas de una búsqueda tras finalizar y almacenamos dichos datos para las estadísticas globales
+    # Devuelve la solución, es decir, las acciones desde el inicio hasta la persona rescatada
     def generar_estadisticas(self, camino):
         print("Generated nodes:", self.nodos_generados)
         print("Expanded nodes:", self.nodos_expandidos)
@@ -294,6 +440,7 @@ class Search(ABC):
         self.ciudad.media_tiempo_ejecucion += self.tiempo_ejecucion
         self.ciudad.media_tamaño_solucion += len(camino)
         self.ciudad.media_coste_solucion += float(self.coste)
+        return list(reversed(camino))
 
 
 # Algoritmo en anchura
@@ -393,6 +540,30 @@ class AEstrella(Search):
         return nodo_lista.qsize() == 0
 
 
+# Algoritmos que compiten en el portfolio de Problema
+algoritmos_portfolio = {
+    'anchura': Anchura,
+    'profundidad': Profundidad,
+    'primero_el_mejor': PrimeroElMejor,
+    'a_estrella': AEstrella,
+}
+
+
+# Proceso de una búsqueda del portfolio, envía por la cola el nombre del algoritmo y su resultado
+# o None si no encuentra a la persona. La salida de la búsqueda se descarta para no mezclarla con la de las demás
+def busqueda_portfolio(ciudad, nombre, rescate, cola):
+    resultado = None
+    try:
+        with open(os.devnull, 'w') as salida, contextlib.redirect_stdout(salida):
+            busqueda = algoritmos_portfolio[nombre](ciudad)
+            camino = busqueda.iniciar_busqueda(rescate)
+        if camino is not None:
+            resultado = {'coste': float(busqueda.coste), 'camino': camino, 'nodos_generados': busqueda.nodos_generados,
+                         'nodos_expandidos': busqueda.nodos_expandidos}
+    finally:
+        cola.put((nombre, resultado))
+
+
 if __name__ == '__main__':
     # Inicializamos el problema cargando el json y parametrizandolo
     problema = Problema('./Lab1/problemas/instance-20-20-33-8-33-2023.json')
@@ -408,4 +579,6 @@ if __name__ == '__main__':
     #problema.resolver_profundidad_iterativa(nodos_de_rescate)
     #problema.resolver_primero_el_mejor(nodos_de_rescate)
     #problema.resolver_A_estrella(nodos_de_rescate)
+    #problema.resolver_portfolio(nodos_de_rescate, archivo_estadisticas='./Lab1/victorias_portfolio.json')
+    #problema.resolver_mejor_algoritmo(nodos_de_rescate, './Lab1/victorias_portfolio.json')
 
@@ -1,19 +1,27 @@
-import itertools
+import gzip
+import heapq
 import json
+import multiprocessing
 import numpy as np
 import os
-import random
-from draw_policy import *
-from time import time
-import pandas as pd
+from multiprocessing import shared_memory
+from scipy import sparse
+from scipy.sparse.linalg import bicgstab, spsolve
+from time import sleep, time
 
 
 class Entorno:
+    # Desplazamiento de cada acción (Arriba, Derecha, Abajo, Izquierda) y sus perpendiculares
+    # tal y como las aplica aplicar_estocasticidad
+    desplazamientos = np.array([[-1, 0], [0, 1], [1, 0], [0, -1]])
+    perpendiculares = np.array([[3, 1], [0, 2], [1, 3], [2, 0]])
+
     def __init__(self, entorno_json, penalizacion, pen_peligro, estocasticidad):
         # Bloque de código encargado de cargar el json que ha sido recibido como parámetro
         with open(entorno_json, 'r') as f:
             ciudad = json.load(f)
         # Inicializamos los datos del problema y los almacenamos en variables
+        self.archivo = entorno_json
         self.filas = ciudad['city']['rows']
         self.columnas = ciudad['city']['columns']
         self.inicio = Estado(ciudad['departure'][0], ciudad['departure'][1])
@@ -25,6 +33,128 @@ class Entorno:
         self.penalizacion = penalizacion
         self.penalizacion_peligro = pen_peligro
         self.estocasticidad = estocasticidad
+        self.construir_modelo()
+
+    # Cambia las penalizaciones y la estocasticidad sin volver a leer el json, por ejemplo entre combinaciones de parámetros
+    def configurar(self, penalizacion, pen_peligro, estocasticidad):
+        self.penalizacion = penalizacion
+        self.penalizacion_peligro = pen_peligro
+        self.estocasticidad = estocasticidad
+        self.construir_modelo()
+
+    # Construye el modelo tabular del entorno con arrays de NumPy, lo usan la Q Tabla, las utilidades y los métodos
+    # vectorizados del agente. Sólo los estados alcanzables desde el inicio reciben un identificador entero consecutivo,
+    # las celdas bloqueadas y las inalcanzables tienen -1 en ids
+    def construir_modelo(self):
+        libres = np.ones((self.filas, self.columnas), dtype=bool)
+        if self.bloqueados:
+            filas_bloqueadas, columnas_bloqueadas = zip(*self.bloqueados)
+            libres[filas_bloqueadas, columnas_bloqueadas] = False
+        coordenadas = np.argwhere(libres)
+        ids = np.full((self.filas, self.columnas), -1, dtype=np.int64)
+        ids[libres] = np.arange(len(coordenadas))
+
+        # Recompensa de cada estado, respetando la misma prioridad que obtener_recompensa
+        recompensas = np.full((self.filas, self.columnas), float(self.penalizacion))
+        terminales = np.zeros((self.filas, self.columnas), dtype=bool)
+        rescates = np.zeros((self.filas, self.columnas), dtype=bool)
+        for (fila, columna), recompensa in self.peligros_fatales.items():
+            recompensas[fila, columna] = recompensa
+            terminales[fila, columna] = True
+        for fila, columna in self.peligros:
+            recompensas[fila, columna] = self.penalizacion_peligro
+        for (fila, columna), recompensa in self.destinos.items():
+            recompensas[fila, columna] = recompensa
+            terminales[fila, columna] = True
+            rescates[fila, columna] = True
+
+        # Celda libre alcanzada con cada acción, -1 si no es válida
+        destinos = coordenadas[:, None, :] + Entorno.desplazamientos[None, :, :]
+        dentro = ((destinos[..., 0] >= 0) & (destinos[..., 0] < self.filas) &
+                  (destinos[..., 1] >= 0) & (destinos[..., 1] < self.columnas))
+        ids_destino = np.where(dentro, ids[np.clip(destinos[..., 0], 0, self.filas - 1),
+                                           np.clip(destinos[..., 1], 0, self.columnas - 1)], -1)
+
+        # Recorrido en anchura desde el inicio por niveles, sin salir de los estados terminales
+        terminales_libres = terminales[libres]
+        alcanzables = np.zeros(len(coordenadas), dtype=bool)
+        frontera = np.array([ids[self.inicio.fila, self.inicio.columna]])
+        alcanzables[frontera] = True
+        while len(frontera):
+            vecinos = ids_destino[frontera[~terminales_libres[frontera]]].ravel()
+            vecinos = np.unique(vecinos[vecinos >= 0])
+            frontera = vecinos[~alcanzables[vecinos]]
+            alcanzables[frontera] = True
+
+        # Identificadores compactos de los estados alcanzables, la última posición traduce el -1 de ids_destino a -1
+        self.coordenadas = coordenadas[alcanzables]
+        self.num_estados = len(self.coordenadas)
+        self.ids = np.full((self.filas, self.columnas), -1, dtype=np.int64)
+        self.ids[self.coordenadas[:, 0], self.coordenadas[:, 1]] = np.arange(self.num_estados)
+        compactos = np.full(len(coordenadas) + 1, -1, dtype=np.int64)
+        compactos[:-1][alcanzables] = np.arange(self.num_estados)
+        self.recompensas = recompensas[self.coordenadas[:, 0], self.coordenadas[:, 1]]
+        self.terminales = terminales[self.coordenadas[:, 0], self.coordenadas[:, 1]]
+        # Terminales que son destinos (personas rescatadas), el resto de terminales son peligros fatales
+        self.rescates = rescates[self.coordenadas[:, 0], self.coordenadas[:, 1]]
+
+        # Estado alcanzado con cada acción, si no es válido nos quedamos en el sitio como en aplicar_accion
+        # Desde un terminal se puede tener al lado una celda inalcanzable, esa acción tampoco es válida
+        ids_destino = compactos[ids_destino[alcanzables]]
+        self.acciones_validas = ids_destino >= 0
+        self.siguientes = np.where(self.acciones_validas, ids_destino, np.arange(self.num_estados)[:, None])
+        # Probabilidad de la acción elegida y de cada una de sus perpendiculares
+        perpendicular = (1 - self.estocasticidad) / 2
+        self.probabilidades = np.array([self.estocasticidad, perpendicular, perpendicular])
+
+    # Índice inverso de transiciones en formato CSR: los predecesores del estado s son
+    # predecesores[inicio[s]:inicio[s + 1]], es decir, los estados no terminales que pueden llegar a s con alguna
+    # acción válida, y probabilidades guarda para cada uno max_a P(s | predecesor, a)
+    # Se incluye el propio estado cuando rebota contra un muro, ya que su utilidad depende de sí misma, y los estados
+    # sin acciones válidas son predecesores de sí mismos con probabilidad 1
+    def indice_predecesores(self):
+        num_acciones = len(Entorno.desplazamientos)
+        # Acción aplicada en cada resultado de cada acción: la elegida y sus dos perpendiculares
+        aplicadas = np.column_stack([np.arange(num_acciones), Entorno.perpendiculares])
+        destinos = self.siguientes[:, aplicadas]
+        probabilidades = np.broadcast_to(self.probabilidades, destinos.shape)
+        origenes = np.broadcast_to(np.arange(self.num_estados)[:, None, None], destinos.shape)
+        acciones = np.broadcast_to(np.arange(num_acciones)[None, :, None], destinos.shape)
+        utiles = np.broadcast_to((self.acciones_validas & ~self.terminales[:, None])[:, :, None], destinos.shape)
+        sin_acciones = np.flatnonzero(~self.terminales & ~self.acciones_validas.any(axis=1))
+        destinos = np.concatenate([destinos[utiles], sin_acciones])
+        origenes = np.concatenate([origenes[utiles], sin_acciones])
+        acciones = np.concatenate([acciones[utiles], np.zeros(len(sin_acciones), dtype=np.int64)])
+        probabilidades = np.concatenate([probabilidades[utiles], np.ones(len(sin_acciones))])
+        # Probabilidad de cada terna (destino, origen, acción), sumando los resultados que caen en el mismo estado
+        claves = (destinos * self.num_estados + origenes) * num_acciones + acciones
+        claves, posiciones = np.unique(claves, return_inverse=True)
+        probabilidades = np.bincount(posiciones, weights=probabilidades)
+        # Máximo sobre las acciones de cada par (destino, origen), las claves ya están ordenadas por par
+        pares, inicio_pares = np.unique(claves // num_acciones, return_index=True)
+        probabilidades = np.maximum.reduceat(probabilidades, inicio_pares)
+        destinos, predecesores = np.divmod(pares, self.num_estados)
+        inicio = np.concatenate([[0], np.cumsum(np.bincount(destinos, minlength=self.num_estados))])
+        return inicio, predecesores, probabilidades
+
+    # Matrices del mapa para draw_policy_grid, con los mismos códigos de celda que draw_policy:
+    # 0 libre, 1 bloqueada, 2 peligro, 3 inicio, 4 destino y 5 peligro fatal, y la recompensa de destinos y peligros fatales
+    def matrices_dibujo(self):
+        matriz = np.zeros((self.filas, self.columnas), dtype=int)
+        recompensas = np.full((self.filas, self.columnas), np.nan)
+        if self.bloqueados:
+            filas_bloqueadas, columnas_bloqueadas = zip(*self.bloqueados)
+            matriz[filas_bloqueadas, columnas_bloqueadas] = 1
+        for fila, columna in self.peligros:
+            matriz[fila, columna] = 2
+        matriz[self.inicio.fila, self.inicio.columna] = 3
+        for (fila, columna), recompensa in self.destinos.items():
+            matriz[fila, columna] = 4
+            recompensas[fila, columna] = recompensa
+        for (fila, columna), recompensa in self.peligros_fatales.items():
+            matriz[fila, columna] = 5
+            recompensas[fila, columna] = recompensa
+        return matriz, recompensas
 
     # Verifica si ese estado está bloqueado
     def es_bloqueado(self, estado):
@@ -51,12 +181,13 @@ class Entorno:
 
     # El agente sólo desea aplicar una accion en base a un estado, es el entorno el encargado de que esa aplicacion se ejecute
     # así como se obtenga la recompensa
+    # Devuelve también la acción realmente tomada, que al explorar no es la elegida por el agente
 
     def mover_agente(self, accion_elegida, estado_actual, explorar):
         if explorar:
             accion_elegida = np.random.choice([0, 1, 2, 3])
         nuevo_estado, recompensa = self.aplicar_accion(accion_elegida, estado_actual)
-        return nuevo_estado, recompensa
+        return nuevo_estado, recompensa, accion_elegida
 
     # Método encargado de aplicar la acción, aquí se tiene en cuenta la estocasticidad del entorno
     # Si el valor es superior a la estocasticidad, se aplica el correspondiente método
@@ -136,6 +267,54 @@ class Entorno:
         return self.penalizacion
 
 
+# Versión vectorizada del entorno que mueve a num_agentes agentes a la vez sobre el modelo tabular de Entorno
+# Los estados son identificadores enteros y los números aleatorios se generan por bloques con un Generator con semilla
+class EntornoVectorizado:
+    def __init__(self, entorno, num_agentes, semilla=None, pasos_por_bloque=256):
+        self.entorno = entorno
+        self.num_agentes = num_agentes
+        self.generador = np.random.default_rng(semilla)
+        self.pasos_por_bloque = pasos_por_bloque
+        self.bloque = None
+        self.posicion = pasos_por_bloque
+        self.id_inicio = entorno.ids[entorno.inicio.fila, entorno.inicio.columna]
+        self.estados = np.full(num_agentes, self.id_inicio)
+        # Pasos del episodio en curso de cada agente
+        self.pasos = np.zeros(num_agentes, dtype=np.int64)
+
+    # Aleatorios de un paso para todos los agentes, cinco filas: exploración, acción aleatoria,
+    # estocasticidad, perpendicular elegida y desempate entre acciones con el mismo valor
+    def aleatorios(self):
+        if self.posicion == self.pasos_por_bloque:
+            self.bloque = self.generador.random((self.pasos_por_bloque, 5, self.num_agentes))
+            self.posicion = 0
+        self.posicion += 1
+        return self.bloque[self.posicion - 1]
+
+    # Aplica las acciones de todos los agentes igual que mover_agente y aplicar_accion, pero con operaciones de arrays
+    # Los agentes que llegan a un destino vuelven al inicio para empezar un nuevo episodio
+    # Con max_pasos también vuelven al inicio los que llevan max_pasos pasos sin llegar, como en episodio se truncan
+    # Devuelve también las acciones aplicadas, las aleatorias en los agentes que han explorado
+    def paso(self, acciones, epsilon, aleatorios, max_pasos=None):
+        acciones = np.where(aleatorios[0] < epsilon, (aleatorios[1] * 4).astype(np.int64), acciones)
+        nuevos_estados = self.transicion(self.estados, acciones, aleatorios[2], aleatorios[3])
+        recompensas = self.entorno.recompensas[nuevos_estados]
+        destinos = self.entorno.terminales[nuevos_estados]
+        self.pasos += 1
+        truncados = ~destinos & (self.pasos >= max_pasos) if max_pasos is not None else np.zeros_like(destinos)
+        finalizados = destinos | truncados
+        self.estados = np.where(finalizados, self.id_inicio, nuevos_estados)
+        self.pasos[finalizados] = 0
+        return acciones, nuevos_estados, recompensas, destinos, truncados
+
+    # Estado al que llega cada agente con su acción tras aplicar la estocasticidad del entorno
+    # a partir de sus aleatorios de estocasticidad y de perpendicular elegida
+    def transicion(self, estados, acciones, aleatorios_estocasticidad, aleatorios_perpendicular):
+        perpendiculares = Entorno.perpendiculares[acciones, (aleatorios_perpendicular >= 0.5).astype(np.int64)]
+        acciones = np.where(aleatorios_estocasticidad > self.entorno.estocasticidad, perpendiculares, acciones)
+        return self.entorno.siguientes[estados, acciones]
+
+
 # Clase en la que definimos el estado
 class Estado:
     def __init__(self, fila, columna):
@@ -167,13 +346,22 @@ class Agente:
         "DOWN": (1, 0),
         "LEFT": (0, -1)
     }
+    # Sufijo en ASCII de los ficheros del informe de cada planificador, el de QLearning es "qlearning"
+    sufijos_informe = {
+        "ITERACIÓN DE POLÍTICAS": "iteracion_politicas",
+        "ITERACIÓN DE POLÍTICAS EXACTA": "iteracion_politicas_exacta",
+        "ITERACIÓN DE POLÍTICAS MODIFICADA": "politicas_modificada",
+        "ITERACIÓN DE VALORES": "iteracion_valores",
+        "BARRIDO PRIORIZADO": "barrido_priorizado"
+    }
 
     def __init__(self, entorno, alpha, gamma, epsilon, decaimiento_epsilon, json_dir, decaimiento_alpha):
         self.entorno = entorno
         self.movimientos = [Agente.direcciones[movimiento] for movimiento in
                             Agente.mov_numericos]  # Arriba, Derecha, Abajo, Izquierda respectivamente
-        self.qtabla = np.zeros((entorno.filas, entorno.columnas, len(self.mov_numericos)))
-        self.u_tabla = {}
+        # Q Tabla y tabla de utilidades indexadas por el identificador de estado del entorno (entorno.ids)
+        self.qtabla = np.zeros((entorno.num_estados, len(self.mov_numericos)))
+        self.u_tabla = np.zeros(entorno.num_estados)
         self.alpha = alpha
         self.alpha_inicial = alpha
         self.gamma = gamma
@@ -185,59 +373,224 @@ class Agente:
         self.tiempo_ejecucion = None
         #self.politica_it = {}
         self.num_episodios = None
+        self.num_iteraciones = None
+        self.residuo = None
+        self.num_barridos = None
+        self.num_actualizaciones = None
+        self.num_pasos = 0
+        self.retorno_final = None
+        self.truncado = False
+        self.episodios_truncados = 0
+        self.episodios_completados = 0
+        self.episodios_asincronos = 0
+        self.control = None
+        self.planificacion = 0
+        self.modelo_siguientes = None
+        # Telemetría por episodio de ejecutar_algoritmo, se reserva con iniciar_telemetria
+        self.telemetria = None
+        self.episodios_registrados = 0
+        # Archivo abierto con abrir_telemetria y episodios del buffer ya escritos en él
+        self.escritor_telemetria = None
+        self.episodios_volcados = 0
+        self.pasos_episodio = 0
+        self.max_delta_q = 0.0
+        # Episodio en el que se detuvo el entrenamiento por parada temprana, None si no se detuvo
+        self.episodio_parada = None
+        # Utilidades de partida de los planificadores, las fijan arranque_en_caliente y arranque_desde_qtabla
+        # y se mantienen hasta llamar a descartar_arranque
+        self.u_inicial = None
+        # Modo de informe de estadisticas: None, 'resumen', 'ficheros' o 'completo'
+        # En los barridos de parámetros y benchmarks se usa None para no imprimir ni dibujar nada
+        self.modo_informe = 'completo'
+        self.directorio_informe = '.'
+        # Valor con el que se descartan las acciones no válidas al elegir la acción de mayor valor
+        # Sin esto el agente se dispersa mucho
+        self.valor_invalido = np.min(self.entorno.recompensas_finales) - 50
+        # A partir de este número de estados la evaluación exacta usa un resolvedor iterativo en lugar del directo
+        # (el directo resuelve el mapa de 500x500, unos 224k estados, en menos de un segundo)
+        self.umbral_resolvedor_directo = 500000
+        # Norma máxima del residuo que se admite en el resolvedor iterativo, absoluta para no depender de la escala de R
+        self.tolerancia_resolvedor = 1e-10
 
     # El agente sólo desea aplicar una accion en base a un estado, es el entorno el encargado de que esa aplicacion se ejecute
-    # así como se obtenga la recompensa
+    # así como se obtenga la recompensa. Devuelve también la acción tomada (la aleatoria si ha explorado)
     def realizar_movimiento(self, accion_elegida, estado_actual):
         explorar = np.random.rand() < self.epsilon  # Es el agente quien decide o no explorar
-        nuevo_estado, recompensa = self.entorno.mover_agente(accion_elegida, estado_actual, explorar)
-        return nuevo_estado, recompensa
+        return self.entorno.mover_agente(accion_elegida, estado_actual, explorar)
 
     # Se selecciona el máximo valor para un estado en la Q tabla asociada a una accion de las 4 posibles en cada nodo
+    # Las acciones no válidas se descartan con la máscara precalculada del entorno
     def max_q(self, estado):
-        posibles_acciones = [self.qtabla[estado.fila][estado.columna][accion] for accion in self.mov_numericos]
-        aux = posibles_acciones
-        for accion in range(len(aux)):
-            if not self.entorno.es_accion_valida(accion, estado):
-                # Con esto, descartamos los índices que llevan a acciones no válidas
-                # Sin esto el agente se dispersa mucho
-                aux[accion] = np.min(self.entorno.recompensas_finales) - 50
-        indices_maximos = np.where(aux == np.max(aux))[0]
-        accion_elegida = np.random.choice(indices_maximos)  # En caso de tener varios índices iguales
-        return accion_elegida
+        id_estado = self.entorno.ids[estado.fila, estado.columna]
+        valores = np.where(self.entorno.acciones_validas[id_estado], self.qtabla[id_estado], self.valor_invalido)
+        indices_maximos = np.flatnonzero(valores == valores.max())
+        if len(indices_maximos) == 1:
+            return indices_maximos[0]
+        return np.random.choice(indices_maximos)  # En caso de tener varios índices iguales
 
     # Aplicación directa de la fórmula de los apuntes, se encarga de actualizar la Q Tabla
+    # También se guarda el mayor cambio absoluto de la Q Tabla en el episodio para la telemetría
     def actualizar_qtabla(self, estado_actual, accion_elegida, recompensa, nuevo_estado, destino):
+        id_actual = self.entorno.ids[estado_actual.fila, estado_actual.columna]
+        valor_anterior = self.qtabla[id_actual, accion_elegida]
         if destino:
-            nuevo_valor = (1.0 - self.alpha) * self.qtabla[estado_actual.fila][estado_actual.columna][
-                accion_elegida] + self.alpha * recompensa
-            self.qtabla[estado_actual.fila][estado_actual.columna][accion_elegida] = nuevo_valor
+            nuevo_valor = (1.0 - self.alpha) * valor_anterior + self.alpha * recompensa
+            self.qtabla[id_actual, accion_elegida] = nuevo_valor
 
         else:
-            nuevo_valor = (1.0 - self.alpha) * self.qtabla[estado_actual.fila][estado_actual.columna][
-                accion_elegida] + self.alpha * (
-                                  recompensa + self.gamma * self.qtabla[nuevo_estado.fila][nuevo_estado.columna][
-                              self.max_q(nuevo_estado)])
-            self.qtabla[estado_actual.fila][estado_actual.columna][accion_elegida] = nuevo_valor
+            id_nuevo = self.entorno.ids[nuevo_estado.fila, nuevo_estado.columna]
+            nuevo_valor = (1.0 - self.alpha) * valor_anterior + self.alpha * (
+                recompensa + self.gamma * self.qtabla[id_nuevo, self.max_q(nuevo_estado)])
+            self.qtabla[id_actual, accion_elegida] = nuevo_valor
+        self.max_delta_q = max(self.max_delta_q, abs(nuevo_valor - valor_anterior))
         return nuevo_valor
 
     # Ejecución del algoritmo en función del número de episodios
-    def ejecutar_algoritmo(self, num_episodios):
+    # max_pasos limita la longitud de cada episodio y presupuesto_tiempo (en segundos) la duración total del entrenamiento
+    # Con archivo_control se guarda un punto de control cada frecuencia_control episodios
+    # Si el entrenamiento se corta por tiempo o se ha reanudado, continúa desde el último episodio completado
+    # Con planificacion > 0 se usa Dyna-Q: tras cada paso real se hacen ese número de actualizaciones simuladas
+    # Con paciencia = K el entrenamiento se detiene cuando la política voraz no cambia durante K episodios seguidos
+    # Si la telemetría está iniciada se registra cada episodio y con archivo_telemetria se escribe en ese archivo
+    # cada vez que se llena el buffer y al terminar (también si se para por tiempo o por paciencia)
+    def ejecutar_algoritmo(self, num_episodios, max_pasos=None, presupuesto_tiempo=None, archivo_control=None,
+                           frecuencia_control=100, planificacion=0, paciencia=None, archivo_telemetria=None):
         self.num_episodios = num_episodios
+        self.planificacion = planificacion
+        if self.planificacion and self.modelo_siguientes is None:
+            self.iniciar_modelo()
+        if archivo_telemetria is not None:
+            if self.telemetria is None:
+                self.iniciar_telemetria()
+            self.abrir_telemetria(archivo_telemetria)
         self.tiempo_ejecucion = time()
-        for i in range(self.num_episodios):
-            self.episodio()
+        self.episodios_truncados = 0
+        self.num_pasos = 0
+        self.episodio_parada = None
+        politica_anterior = self.politica_determinista() if paciencia is not None else None
+        episodios_sin_cambios = 0
+        for i in range(self.episodios_completados, self.num_episodios):
+            if presupuesto_tiempo is not None and time() - self.tiempo_ejecucion > presupuesto_tiempo:
+                break
+            self.retorno_final = self.episodio(max_pasos)
+            self.episodios_truncados += self.truncado
+            self.episodios_completados = i + 1
+            if self.telemetria is not None:
+                self.registrar_telemetria()
+            if archivo_control is not None and self.episodios_completados % frecuencia_control == 0:
+                self.guardar_control(archivo_control)
+            if paciencia is not None:
+                politica = self.politica_determinista()
+                episodios_sin_cambios = episodios_sin_cambios + 1 if np.array_equal(politica, politica_anterior) else 0
+                politica_anterior = politica
+                if episodios_sin_cambios >= paciencia:
+                    self.episodio_parada = self.episodios_completados
+                    break
+        if archivo_control is not None:
+            self.guardar_control(archivo_control)
+        if archivo_telemetria is not None:
+            self.volcar_telemetria(cerrar=True)
+        # Si se han completado todos los episodios o se ha parado antes, una nueva llamada vuelve a empezar la cuenta
+        if self.episodios_completados == self.num_episodios or self.episodio_parada is not None:
+            self.episodios_completados = 0
         self.tiempo_ejecucion = time() - self.tiempo_ejecucion
         return self.obtener_politica()
 
+    # Política voraz sobre los estados con desempate determinista (la primera acción de mayor valor)
+    # obtener_politica desempata al azar, así que no sirve para comprobar si la política ha cambiado
+    def politica_determinista(self):
+        return self.politica_voraz(self.qtabla)
+
+    # Reserva el buffer circular de la telemetría, guarda los últimos capacidad episodios sin reservar memoria en cada uno
+    def iniciar_telemetria(self, capacidad=100000):
+        self.telemetria = np.zeros(capacidad, dtype=[('episodio', np.int64), ('pasos', np.int64), ('retorno', np.float64),
+                                                     ('max_delta_q', np.float64), ('epsilon', np.float64),
+                                                     ('alpha', np.float64)])
+        self.episodios_registrados = 0
+
+    def registrar_telemetria(self):
+        self.telemetria[self.episodios_registrados % len(self.telemetria)] = (
+            self.episodios_completados, self.pasos_episodio, self.retorno_final, self.max_delta_q, self.epsilon,
+            self.alpha)
+        self.episodios_registrados += 1
+        # Antes de que el buffer empiece a sobrescribir episodios sin escribir, se añaden al archivo
+        if self.escritor_telemetria is not None and \
+                self.episodios_registrados - self.episodios_volcados == len(self.telemetria):
+            self.volcar_telemetria()
+
+    # Episodios guardados en la telemetría en orden cronológico
+    def obtener_telemetria(self):
+        capacidad = len(self.telemetria)
+        if self.episodios_registrados <= capacidad:
+            return self.telemetria[:self.episodios_registrados]
+        return np.roll(self.telemetria, -(self.episodios_registrados % capacidad))
+
+    # Abre el archivo de telemetría, un csv o, si la extensión es .parquet, un Parquet (requiere pyarrow)
+    # El archivo sólo recoge los episodios registrados a partir de ahora
+    def abrir_telemetria(self, archivo_telemetria):
+        nombres = self.telemetria.dtype.names
+        if archivo_telemetria.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            esquema = pa.schema([(nombre, pa.from_numpy_dtype(self.telemetria.dtype[nombre])) for nombre in nombres])
+            self.escritor_telemetria = pq.ParquetWriter(archivo_telemetria, esquema)
+        else:
+            self.escritor_telemetria = open(archivo_telemetria, 'w')
+            self.escritor_telemetria.write(','.join(nombres) + '\n')
+        self.episodios_volcados = self.episodios_registrados
+
+    # Añade al archivo los episodios registrados que aún no se han escrito, en orden cronológico
+    # Con cerrar=True se cierra el archivo al terminar
+    def volcar_telemetria(self, cerrar=False):
+        registros = self.obtener_telemetria()
+        registros = registros[len(registros) - (self.episodios_registrados - self.episodios_volcados):]
+        if len(registros):
+            if hasattr(self.escritor_telemetria, 'write_table'):
+                import pyarrow as pa
+                self.escritor_telemetria.write_table(pa.table({nombre: registros[nombre]
+                                                               for nombre in registros.dtype.names}))
+            else:
+                np.savetxt(self.escritor_telemetria, registros, delimiter=',',
+                           fmt=['%d', '%d', '%.10g', '%.10g', '%.10g', '%.10g'])
+        self.episodios_volcados = self.episodios_registrados
+        if cerrar:
+            self.escritor_telemetria.close()
+            self.escritor_telemetria = None
+
+    # Guarda la Q Tabla, épsilon, alpha y los episodios completados en un .npy mapeado en memoria
+    # El archivo se crea una sola vez y el resto de puntos de control se escriben sobre él
+    def guardar_control(self, archivo_control):
+        tamano = self.qtabla.size + 3
+        if self.control is None or self.control.filename != os.path.abspath(archivo_control):
+            self.control = np.lib.format.open_memmap(archivo_control, mode='w+', dtype=np.float64, shape=(tamano,))
+        self.control[:self.qtabla.size] = self.qtabla.ravel()
+        self.control[self.qtabla.size:] = [self.epsilon, self.alpha, self.episodios_completados]
+        self.control.flush()
+
+    # Carga un punto de control, la siguiente llamada a ejecutar_algoritmo continúa desde el episodio guardado
+    def reanudar(self, archivo_control):
+        control = np.load(archivo_control, mmap_mode='r')
+        if control.shape != (self.qtabla.size + 3,):
+            raise ValueError(f"El punto de control {archivo_control} no corresponde a este entorno")
+        self.qtabla = np.array(control[:self.qtabla.size]).reshape(self.qtabla.shape)
+        self.epsilon, self.alpha, episodios_completados = control[self.qtabla.size:].tolist()
+        self.episodios_completados = int(episodios_completados)
+
     # Método encargado de aplicar un episodio, finaliza cuando llega a un estado de meta y actualiza la Q Tabla
     # Aplicación directa del pseucocódigo de los apuntes
-    def episodio(self):
+    # Devuelve el retorno del episodio, es decir, la suma de las recompensas obtenidas
+    # Si se alcanzan max_pasos sin llegar a un destino el episodio se corta y se marca como truncado
+    def episodio(self, max_pasos=None):
         estado_actual = self.entorno.inicio
         destino = False
-        while not destino:
+        retorno = 0
+        pasos = 0
+        self.max_delta_q = 0.0
+        while not destino and (max_pasos is None or pasos < max_pasos):
+            pasos += 1
             accion_elegida = self.max_q(estado_actual)
-            nuevo_estado, recompensa = self.realizar_movimiento(accion_elegida, estado_actual)
+            nuevo_estado, recompensa, accion_tomada = self.realizar_movimiento(accion_elegida, estado_actual)
+            retorno += recompensa
             if self.entorno.es_destino(nuevo_estado):
                 destino = True
                 # Decaimiento de épsilon en cada final de episodio
@@ -248,40 +601,362 @@ class Agente:
                 # con el decaimiento de Alpha encontramos un equilibrio
                 self.alpha = self.alpha_inicial * self.decaimiento_alpha ** self.num_episodios
             self.actualizar_qtabla(estado_actual, accion_elegida, recompensa, nuevo_estado, destino)
+            if self.planificacion:
+                # El modelo guarda la acción que ha producido la transición, no la elegida por max_q
+                self.registrar_transicion(estado_actual, accion_tomada, recompensa, nuevo_estado, destino)
+                self.planificar()
             estado_actual = nuevo_estado
+        self.num_pasos += pasos
+        self.pasos_episodio = pasos
+        self.truncado = not destino
+        if self.truncado:
+            # Un episodio truncado también es un final de episodio para los decaimientos
+            self.epsilon *= self.decaimiento_epsilon
+            self.alpha = self.alpha_inicial * self.decaimiento_alpha ** self.num_episodios
+        return retorno
+
+    # QLearning con trazas de elegibilidad, Q(lambda) de Watkins o SARSA(lambda) según el método
+    def ejecutar_algoritmo_trazas(self, num_episodios, lambda_traza=0.9, metodo='watkins', umbral_traza=0.01,
+                                  max_pasos=None):
+        self.num_episodios = num_episodios
+        self.tiempo_ejecucion = time()
+        self.num_pasos = 0
+        for i in range(self.num_episodios):
+            self.retorno_final = self.episodio_trazas(lambda_traza, metodo, umbral_traza, max_pasos)
+        self.tiempo_ejecucion = time() - self.tiempo_ejecucion
+        return self.obtener_politica()
+
+    # Episodio con trazas de elegibilidad reemplazantes guardadas en un diccionario disperso
+    # Las trazas que bajan de umbral_traza se eliminan, así cada actualización sólo toca las celdas visitadas recientemente
+    # En Watkins las trazas se cortan al tomar una acción exploratoria, en SARSA se mantienen
+    def episodio_trazas(self, lambda_traza, metodo, umbral_traza, max_pasos=None):
+        trazas = {}
+        estado_actual = self.entorno.inicio
+        accion_elegida = self.accion_epsilon_voraz(estado_actual)[0]
+        destino = False
+        retorno = 0
+        pasos = 0
+        while not destino and (max_pasos is None or pasos < max_pasos):
+            pasos += 1
+            # El agente decide la acción (incluida la exploración) y el entorno sólo aplica la estocasticidad
+            nuevo_estado, recompensa = self.entorno.aplicar_accion(accion_elegida, estado_actual)
+            retorno += recompensa
+            destino = self.entorno.es_destino(nuevo_estado)
+            id_actual = self.entorno.ids[estado_actual.fila, estado_actual.columna]
+            valor_actual = self.qtabla[id_actual, accion_elegida]
+            if destino:
+                delta = recompensa - valor_actual
+                siguiente_accion, voraz = None, True
+            else:
+                siguiente_accion, exploratoria = self.accion_epsilon_voraz(nuevo_estado)
+                accion_objetivo = siguiente_accion if metodo == 'sarsa' else self.max_q(nuevo_estado)
+                id_nuevo = self.entorno.ids[nuevo_estado.fila, nuevo_estado.columna]
+                delta = recompensa + self.gamma * self.qtabla[id_nuevo, accion_objetivo] - valor_actual
+                # La acción explorada es voraz si empata con el máximo entre las acciones válidas, comparar con
+                # max_q no sirve porque rompe los empates al azar
+                valores = np.where(self.entorno.acciones_validas[id_nuevo], self.qtabla[id_nuevo], self.valor_invalido)
+                voraz = not exploratoria or valores[siguiente_accion] >= valores.max()
+            trazas[(id_actual, accion_elegida)] = 1.0
+            for par, traza in list(trazas.items()):
+                self.qtabla[par] += self.alpha * delta * traza
+                traza *= self.gamma * lambda_traza
+                if traza < umbral_traza:
+                    del trazas[par]
+                else:
+                    trazas[par] = traza
+            if metodo == 'watkins' and not voraz:
+                trazas.clear()
+            estado_actual = nuevo_estado
+            accion_elegida = siguiente_accion
+        self.num_pasos += pasos
+        self.truncado = not destino
+        # Decaimiento de épsilon y alpha en cada final de episodio como en episodio
+        self.epsilon *= self.decaimiento_epsilon
+        self.alpha = self.alpha_inicial * self.decaimiento_alpha ** self.num_episodios
+        return retorno
+
+    # Acción epsilon-voraz elegida por el propio agente, indica también si ha sido exploratoria
+    def accion_epsilon_voraz(self, estado):
+        if np.random.rand() < self.epsilon:
+            return np.random.choice(self.mov_numericos), True
+        return self.max_q(estado), False
+
+    # Modelo de Dyna-Q guardado en arrays indexados por estado y acción. El entorno es estocástico, así que de cada par
+    # se guardan los distintos estados siguientes observados (como mucho tres: la acción y sus dos perpendiculares)
+    # con su recompensa y el número de veces que se ha llegado a cada uno
+    # pares_observados guarda los pares ya vistos (estado * 4 + acción) para muestrear sólo entre ellos
+    def iniciar_modelo(self):
+        forma = (self.entorno.num_estados, len(self.mov_numericos), len(self.entorno.probabilidades))
+        self.modelo_siguientes = np.full(forma, -1, dtype=np.int64)
+        self.modelo_recompensas = np.zeros(forma)
+        self.modelo_destinos = np.zeros(forma, dtype=bool)
+        self.modelo_conteos = np.zeros(forma)
+        self.pares_observados = np.empty(forma[0] * forma[1], dtype=np.int64)
+        self.num_pares_observados = 0
+
+    def registrar_transicion(self, estado, accion, recompensa, nuevo_estado, destino):
+        id_estado = self.entorno.ids[estado.fila, estado.columna]
+        id_nuevo = self.entorno.ids[nuevo_estado.fila, nuevo_estado.columna]
+        siguientes = self.modelo_siguientes[id_estado, accion]
+        if siguientes[0] == -1:
+            self.pares_observados[self.num_pares_observados] = id_estado * len(self.mov_numericos) + accion
+            self.num_pares_observados += 1
+        # Posición del estado siguiente si ya se había observado, si no la primera libre
+        posicion = np.flatnonzero((siguientes == id_nuevo) | (siguientes == -1))[0]
+        siguientes[posicion] = id_nuevo
+        self.modelo_recompensas[id_estado, accion, posicion] = recompensa
+        self.modelo_destinos[id_estado, accion, posicion] = destino
+        self.modelo_conteos[id_estado, accion, posicion] += 1
+
+    # Actualizaciones simuladas de Dyna-Q, todas a la vez sobre pares estado-acción ya observados
+    # Cada una es el valor esperado según las frecuencias observadas de cada estado siguiente, así un resbalón
+    # aislado no se repite en la planificación como si fuera seguro
+    def planificar(self):
+        pares = self.pares_observados[np.random.randint(0, self.num_pares_observados, self.planificacion)]
+        estados, acciones = np.divmod(pares, len(self.mov_numericos))
+        siguientes = self.modelo_siguientes[estados, acciones]
+        conteos = self.modelo_conteos[estados, acciones]
+        # Las posiciones sin observar (-1) tienen frecuencia 0, el índice sólo tiene que ser válido
+        mejor_valor = np.where(self.entorno.acciones_validas[siguientes], self.qtabla[siguientes],
+                               self.valor_invalido).max(axis=2)
+        resultados = self.modelo_recompensas[estados, acciones] + np.where(self.modelo_destinos[estados, acciones], 0.0,
+                                                                            self.gamma * mejor_valor)
+        objetivo = (conteos * resultados).sum(axis=1) / conteos.sum(axis=1)
+        nuevos_valores = (1.0 - self.alpha) * self.qtabla[estados, acciones] + self.alpha * objetivo
+        self.max_delta_q = max(self.max_delta_q, np.abs(nuevos_valores - self.qtabla[estados, acciones]).max())
+        self.qtabla[estados, acciones] = nuevos_valores
+
+    # Q-learning con num_agentes agentes en paralelo sobre EntornoVectorizado, la Q Tabla se actualiza por lotes
+    # Si varios agentes actualizan el mismo par estado-acción en un paso, prevalece la última escritura
+    # presupuesto_tiempo (en segundos) limita la duración total y max_pasos la de cada episodio como en
+    # ejecutar_algoritmo. Los episodios truncados cuentan como episodios terminados, pero su último paso no es terminal
+    def ejecutar_algoritmo_vectorizado(self, num_episodios, num_agentes=256, semilla=None, presupuesto_tiempo=None,
+                                       max_pasos=None):
+        self.num_episodios = num_episodios
+        self.episodios_truncados = 0
+        self.tiempo_ejecucion = time()
+        entorno_vectorizado = EntornoVectorizado(self.entorno, num_agentes, semilla)
+        qtabla = self.qtabla
+        validas = self.entorno.acciones_validas
+        retornos = np.zeros(num_agentes)
+        episodios = 0
+        self.num_pasos = 0
+        while episodios < num_episodios:
+            if presupuesto_tiempo is not None and time() - self.tiempo_ejecucion > presupuesto_tiempo:
+                break
+            estados = entorno_vectorizado.estados
+            aleatorios = entorno_vectorizado.aleatorios()
+            acciones = self.argmax_aleatorio(qtabla[estados], validas[estados], aleatorios[4])
+            # Se actualiza el valor de la acción que se ha aplicado en cada agente, no el de la voraz
+            acciones, nuevos_estados, recompensas, destinos, truncados = entorno_vectorizado.paso(
+                acciones, self.epsilon, aleatorios, max_pasos)
+            siguientes = np.argmax(np.where(validas[nuevos_estados], qtabla[nuevos_estados], self.valor_invalido), axis=1)
+            objetivo = recompensas + np.where(destinos, 0.0, self.gamma * qtabla[nuevos_estados, siguientes])
+            qtabla[estados, acciones] = (1.0 - self.alpha) * qtabla[estados, acciones] + self.alpha * objetivo
+            self.num_pasos += num_agentes
+            retornos += recompensas
+            terminados = destinos | truncados
+            finalizados = int(np.count_nonzero(terminados))
+            if finalizados:
+                self.retorno_final = float(retornos[terminados][-1])
+                retornos[terminados] = 0.0
+                self.episodios_truncados += int(np.count_nonzero(truncados))
+                # Mismo decaimiento que en episodio, una vez por cada episodio terminado
+                episodios += finalizados
+                self.epsilon *= self.decaimiento_epsilon ** finalizados
+                self.alpha = self.alpha_inicial * self.decaimiento_alpha ** self.num_episodios
+        self.tiempo_ejecucion = time() - self.tiempo_ejecucion
+        return self.obtener_politica()
+
+    # QLearning asíncrono: num_procesos procesos ejecutan episodio_modelo a la vez sobre una única Q Tabla en memoria
+    # compartida y la actualizan sin bloqueos (Hogwild), los num_episodios se reparten entre ellos
+    # Cada proceso tiene su propio Generator (derivado de semilla) y su propio épsilon inicial, por defecto repartidos
+    # entre epsilon y epsilon / 10, que decae con sus propios episodios
+    # Con paciencia = K el proceso principal detiene a todos cuando la política voraz no cambia durante K episodios,
+    # contando los de todos los procesos; se comprueba cada intervalo segundos
+    def ejecutar_algoritmo_asincrono(self, num_episodios, num_procesos=None, semilla=None, epsilons=None,
+                                     max_pasos=None, paciencia=None, presupuesto_tiempo=None, intervalo=0.05):
+        num_procesos = os.cpu_count() if num_procesos is None else num_procesos
+        if epsilons is None:
+            epsilons = np.geomspace(self.epsilon, self.epsilon / 10, num_procesos).tolist()
+        self.num_episodios = num_episodios
+        self.tiempo_ejecucion = time()
+        self.episodio_parada = None
+        semillas = np.random.SeedSequence(semilla).spawn(num_procesos)
+        # Cada proceso vuelve a cargar el entorno desde su json y crea su propio agente con estos parámetros,
+        # así no se copia el agente entero (Q Tabla, telemetría, punto de control...) en cada proceso
+        configuracion = (self.entorno.archivo, self.entorno.penalizacion, self.entorno.penalizacion_peligro,
+                         self.entorno.estocasticidad)
+        parametros = {'alpha': self.alpha, 'alpha_inicial': self.alpha_inicial, 'gamma': self.gamma,
+                      'decaimiento_epsilon': self.decaimiento_epsilon, 'decaimiento_alpha': self.decaimiento_alpha,
+                      'num_episodios': num_episodios}
+        memoria = shared_memory.SharedMemory(create=True, size=self.qtabla.nbytes)
+        qtabla = None
+        procesos = []
+        parada = multiprocessing.Event()
+        try:
+            qtabla = np.ndarray(self.qtabla.shape, dtype=self.qtabla.dtype, buffer=memoria.buf)
+            qtabla[:] = self.qtabla
+            # Episodios y pasos de cada proceso, cada uno sólo escribe en sus dos posiciones
+            contadores = multiprocessing.Array('q', 2 * num_procesos, lock=False)
+            procesos = [multiprocessing.Process(target=proceso_asincrono, args=(
+                configuracion, parametros, memoria.name, contadores, i,
+                num_episodios // num_procesos + (i < num_episodios % num_procesos), semillas[i], epsilons[i],
+                max_pasos, parada)) for i in range(num_procesos)]
+            for proceso in procesos:
+                proceso.start()
+            politica_anterior = self.politica_voraz(qtabla)
+            ultimo_cambio = 0
+            while any(proceso.is_alive() for proceso in procesos):
+                sleep(intervalo)
+                if presupuesto_tiempo is not None and time() - self.tiempo_ejecucion > presupuesto_tiempo:
+                    parada.set()
+                if paciencia is not None and not parada.is_set():
+                    episodios = sum(contadores[0::2])
+                    politica = self.politica_voraz(qtabla)
+                    if not np.array_equal(politica, politica_anterior):
+                        politica_anterior = politica
+                        ultimo_cambio = episodios
+                    elif episodios - ultimo_cambio >= paciencia:
+                        self.episodio_parada = episodios
+                        parada.set()
+            for proceso in procesos:
+                proceso.join()
+            # Si algún proceso ha fallado la Q Tabla compartida está a medio entrenar, no se da por buena
+            fallidos = [proceso.exitcode for proceso in procesos if proceso.exitcode != 0]
+            if fallidos:
+                raise RuntimeError(f"{len(fallidos)} de {num_procesos} procesos de QLearning asíncrono han terminado "
+                                   f"con error (códigos de salida {fallidos})")
+            self.qtabla = qtabla.copy()
+        finally:
+            # Si se sale por una excepción se detiene a los procesos que sigan en marcha
+            parada.set()
+            for proceso in procesos:
+                if proceso.pid is not None:
+                    proceso.join()
+            # La vista sobre la memoria compartida debe liberarse antes de cerrarla
+            qtabla = None
+            memoria.close()
+            memoria.unlink()
+        # Los episodios del asíncrono se guardan aparte, episodios_completados es la posición de reanudación
+        # de ejecutar_algoritmo y no debe cambiar aquí
+        self.episodios_asincronos = sum(contadores[0::2])
+        self.num_pasos = sum(contadores[1::2])
+        self.tiempo_ejecucion = time() - self.tiempo_ejecucion
+        return self.obtener_politica()
+
+    # Episodio de QLearning como episodio pero sobre los identificadores de estado del modelo tabular del entorno
+    # Los aleatorios salen del Generator del proceso y la Q Tabla se actualiza en el sitio, sin copias
+    def episodio_modelo(self, generador, max_pasos=None):
+        estado = self.entorno.ids[self.entorno.inicio.fila, self.entorno.inicio.columna]
+        validas = self.entorno.acciones_validas
+        destino = False
+        retorno = 0
+        pasos = 0
+        while not destino and (max_pasos is None or pasos < max_pasos):
+            pasos += 1
+            # Aleatorios del paso: desempate, exploración, acción aleatoria, estocasticidad y perpendicular elegida
+            aleatorios = generador.random(5)
+            valores = np.where(validas[estado], self.qtabla[estado], self.valor_invalido)
+            empates = np.flatnonzero(valores == valores.max())
+            accion = empates[int(aleatorios[0] * len(empates))]
+            # La exploración cambia la acción aplicada, que es la que se actualiza, y la estocasticidad
+            # la dirección en la que se mueve el agente
+            if aleatorios[1] < self.epsilon:
+                accion = int(aleatorios[2] * len(self.mov_numericos))
+            direccion = accion
+            if aleatorios[3] > self.entorno.estocasticidad:
+                direccion = Entorno.perpendiculares[accion, int(aleatorios[4] >= 0.5)]
+            nuevo_estado = self.entorno.siguientes[estado, direccion]
+            recompensa = self.entorno.recompensas[nuevo_estado]
+            retorno += recompensa
+            destino = self.entorno.terminales[nuevo_estado]
+            objetivo = recompensa
+            if not destino:
+                objetivo += self.gamma * np.where(validas[nuevo_estado], self.qtabla[nuevo_estado],
+                                                  self.valor_invalido).max()
+            self.qtabla[estado, accion] = (1.0 - self.alpha) * self.qtabla[estado, accion] + self.alpha * objetivo
+            estado = nuevo_estado
+        self.num_pasos += pasos
+        self.truncado = not destino
+        # Mismos decaimientos que en episodio al final de cada episodio
+        self.epsilon *= self.decaimiento_epsilon
+        self.alpha = self.alpha_inicial * self.decaimiento_alpha ** self.num_episodios
+        return retorno
+
+    # Evaluación de Monte Carlo de una política: num_episodios episodios a la vez desde el inicio, sin exploración
+    # La política puede ser un diccionario como self.politica (por defecto) o un array con la acción de cada estado
+    # Los agentes que terminan salen del lote, así cada paso sólo mueve a los que siguen activos
+    # Los episodios que llegan a max_pasos sin terminar cuentan como truncados
+    def evaluacion_montecarlo(self, politica=None, num_episodios=10000, max_pasos=1000, semilla=None):
+        politica = self.politica if politica is None else politica
+        acciones = politica if isinstance(politica, np.ndarray) else self.politica_a_indices(politica)
+        entorno_vectorizado = EntornoVectorizado(self.entorno, num_episodios, semilla)
+        activos = np.arange(num_episodios)
+        estados = entorno_vectorizado.estados.copy()
+        retornos = np.zeros(num_episodios)
+        longitudes = np.full(num_episodios, max_pasos)
+        rescatados = np.zeros(num_episodios, dtype=bool)
+        fatales = np.zeros(num_episodios, dtype=bool)
+        for paso in range(1, max_pasos + 1):
+            if not len(activos):
+                break
+            aleatorios = entorno_vectorizado.generador.random((2, len(activos)))
+            estados = entorno_vectorizado.transicion(estados, acciones[estados], aleatorios[0], aleatorios[1])
+            retornos[activos] += self.entorno.recompensas[estados]
+            terminados = self.entorno.terminales[estados]
+            if terminados.any():
+                finalizados = activos[terminados]
+                longitudes[finalizados] = paso
+                rescatados[finalizados] = self.entorno.rescates[estados[terminados]]
+                fatales[finalizados] = ~self.entorno.rescates[estados[terminados]]
+                activos = activos[~terminados]
+                estados = estados[~terminados]
+        return {
+            'tasa_exito': float(rescatados.mean()),
+            'tasa_fatal': float(fatales.mean()),
+            'tasa_truncados': len(activos) / num_episodios,
+            'retorno_medio': float(retornos.mean()),
+            'longitud_media': float(longitudes.mean()),
+        }
+
+    # Acción de mayor valor en cada fila descartando las no válidas como en max_q
+    # Los empates se resuelven al azar con un único número aleatorio por fila
+    def argmax_aleatorio(self, valores, validas, aleatorios):
+        valores = np.where(validas, valores, self.valor_invalido)
+        empates = valores == valores.max(axis=1, keepdims=True)
+        elegido = (aleatorios * np.count_nonzero(empates, axis=1)).astype(np.int64)
+        return np.argmax(np.cumsum(empates, axis=1) > elegido[:, None], axis=1)
 
     # Con esto obtenemos la política dentro de todos los estados posibles que no sean ni destinos ni bloqueados
     # En función de los valores máximos de la Q Tabla en cada nodo
     def obtener_politica(self):
-        politica = {}
-        estados_posibles = [(fila, columna) for fila in range(self.entorno.filas) for columna in
-                            range(self.entorno.columnas)]
-        for estado in estados_posibles:
-            if estado not in self.entorno.destinos and estado not in self.entorno.peligros_fatales and estado not in self.entorno.bloqueados:
-                politica[estado[0], estado[1]] = self.direcciones.get(self.max_q(Estado(estado[0], estado[1])))
-        self.politica = politica
+        # Acción de mayor valor de todos los estados a la vez, con la máscara de acciones válidas del entorno
+        acciones = self.argmax_aleatorio(self.qtabla, self.entorno.acciones_validas,
+                                         np.random.rand(self.entorno.num_estados))
+        self.politica = self.indices_a_politica(acciones)
         self.estadisticas()
-        return politica
+        return self.politica
 
-    def estadisticas(self, iterativa=False):
+    # El modo de informe decide qué se muestra al terminar un algoritmo:
+    # None no muestra nada, 'resumen' sólo los datos generales, 'ficheros' además vuelca la política y las tablas
+    # a ficheros comprimidos sin imprimirlas y 'completo' lo imprime todo y dibuja la política
+    def estadisticas(self, iterativa=False, algoritmo="ITERACIÓN DE POLÍTICAS"):
+        if self.modo_informe is None:
+            return
+        if self.modo_informe not in ('resumen', 'ficheros', 'completo'):
+            raise ValueError(f"Modo de informe desconocido: {self.modo_informe}")
         # En función de si es llamada desde iteratición de políticas o no, imprime las estadísticas pertinentes
         if iterativa:
-            df = pd.DataFrame(list(self.u_tabla.items()), index=None, columns=['Estado', 'Valor'])
-            print("----ITERACIÓN DE POLÍTICAS----")
+            print(f"----{algoritmo}----")
             print("\n ")
-            print(f"Número de iteraciones realizadas: {self.num_episodios}")
+            print(f"Número de iteraciones realizadas: {self.num_iteraciones or self.num_episodios}")
+            if self.num_barridos is not None:
+                print(f"Barridos de evaluación realizados: {self.num_barridos}")
+            if self.residuo is not None:
+                print(f"Residuo de Bellman final: {self.residuo}")
             print(f"Tiempo de ejecución: {self.tiempo_ejecucion}")
             print("\n ")
-            print("----Tabla de utilidades final----")
-            print("\n ")
-            print(df.to_string(index=False))
-            print("\n ")
-            print("----POLÍTICA OBTENIDA CON ITERACIÓN DE POLÍTICAS----")
-            for estado, accion in self.politica.items():
-                print(f"\"({estado[0]}, {estado[1]})\": \"{accion}\"")
-            print("----MAPA DE LA POLÍTICA CON ITERACIÓN DE POLÍTICAS----")
-            print("\n ")
-            draw_policy_map(json_dir, self.politica)
         else:
             destinos = []
             for estados in self.entorno.destinos.keys():
@@ -290,34 +965,94 @@ class Agente:
             print("\n ")
             print(f"Número de episodios: {self.num_episodios}")
             print(f"Estado inicial: {self.entorno.inicio}")
-            print(f"Personas a rescatar: {destinos}")
+            if self.modo_informe == 'completo':
+                print(f"Personas a rescatar: {destinos}")
+            else:
+                print(f"Personas a rescatar: {len(destinos)}")
             print(f"Tamaño de la ciudad: {self.entorno.filas} x {self.entorno.columnas}")
             print(f"Tiempo de ejecución del Algoritmo: {self.tiempo_ejecucion:.2f} segundos")
+            if self.episodios_truncados:
+                print(f"Episodios truncados por límite de pasos: {self.episodios_truncados}")
+            if self.episodio_parada is not None:
+                print(f"Parada temprana en el episodio: {self.episodio_parada}")
+            print("\n ")
+
+        if self.modo_informe == 'ficheros':
+            self.volcar_informe(iterativa, algoritmo)
+        elif self.modo_informe == 'completo':
+            self.informe_completo(iterativa, algoritmo)
+
+    # Imprime las tablas y la política completas y dibuja el mapa, pandas y matplotlib sólo se importan aquí
+    def informe_completo(self, iterativa, algoritmo):
+        import pandas as pd
+        if iterativa:
+            df = pd.DataFrame(list(self.utilidades_a_diccionario(self.u_tabla).items()), index=None,
+                              columns=['Estado', 'Valor'])
+            print("----Tabla de utilidades final----")
             print("\n ")
+            print(df.to_string(index=False))
+            print("\n ")
+            print(f"----POLÍTICA OBTENIDA CON {algoritmo}----")
+            for estado, accion in self.politica.items():
+                print(f"\"({estado[0]}, {estado[1]})\": \"{accion}\"")
+            print(f"----MAPA DE LA POLÍTICA CON {algoritmo}----")
+            print("\n ")
+            self.dibujar_politica()
+        else:
+            # Una fila por celda alcanzable, con la misma clave (fila, columna) que la tabla de utilidades
+            df = pd.DataFrame(self.qtabla, columns=self.movimientos)
+            df.insert(0, 'Estado', [(int(fila), int(columna)) for fila, columna in self.entorno.coordenadas])
             print("----QTabla----")
             print("\n ")
-            print(self.qtabla)
+            print(df.to_string(index=False))
             print("\n ")
             print("----POLÍTICA OBTENIDA CON QQLEARNING----")
             for estado, accion in self.politica.items():
                 print(f"\"({estado[0]}, {estado[1]})\": \"{accion}\"")
             print("----MAPA DE LA POLÍTICA OBTENIDA QQLEARNING----")
             print("\n ")
-            draw_policy_map(json_dir, self.politica)
+            self.dibujar_politica()
+
+    # Dibuja la política actual con las matrices del entorno ya cargado, sin volver a leer el json
+    # Las opciones se pasan tal cual a draw_policy_grid (save_to_file, downsample, tile_size...)
+    def dibujar_politica(self, **opciones):
+        from draw_policy import draw_policy_grid
+        matriz, recompensas = self.entorno.matrices_dibujo()
+        draw_policy_grid(matriz, self.politica_a_matriz(), recompensas, self.nombre_informe(), **opciones)
+
+    # Nombre base de las imágenes y ficheros del informe, el del json si se conoce
+    def nombre_informe(self):
+        return os.path.splitext(os.path.basename(self.json_dir))[0] if self.json_dir else "informe"
+
+    # Escribe la política y la tabla del algoritmo en ficheros comprimidos dentro de directorio_informe,
+    # fila a fila para no construir el texto completo en memoria
+    def volcar_informe(self, iterativa, algoritmo):
+        nombre = self.nombre_informe()
+        sufijo = Agente.sufijos_informe[algoritmo] if iterativa else "qlearning"
+        prefijo = os.path.join(self.directorio_informe, f"{nombre}_{sufijo}")
+        with gzip.open(f"{prefijo}_politica.csv.gz", "wt") as f:
+            f.write("fila,columna,accion\n")
+            for (fila, columna), accion in self.politica.items():
+                f.write(f"{fila},{columna},{accion}\n")
+        if iterativa:
+            with gzip.open(f"{prefijo}_utilidades.csv.gz", "wt") as f:
+                f.write("fila,columna,valor\n")
+                for (fila, columna), valor in zip(self.entorno.coordenadas, self.u_tabla):
+                    f.write(f"{fila},{columna},{valor}\n")
+        else:
+            with gzip.open(f"{prefijo}_qtabla.npy.gz", "wb") as f:
+                np.save(f, self.qtabla)
+        print(f"Política y tablas guardadas en {prefijo}_*.gz")
 
     # ---------------------------------- EJERCICIO PARTE EXTRAORDINARIA ----------------------------------
-    def iteracion_de_politicas(self):
-        estados_posibles = [(fila, columna) for fila in range(self.entorno.filas) for columna in
-                            range(self.entorno.columnas) if (fila, columna) not in self.entorno.bloqueados]
-        # Inicializamos la Tabla de Utilidades
-        for estado in estados_posibles:
-            e = Estado(estado[0], estado[1])
-            if self.entorno.es_destino(e):
-                d_aux = {estado: self.entorno.obtener_recompensa(e)}
-                self.u_tabla.update(d_aux)
-            else:
-                d_aux = {estado: 0}
-                self.u_tabla.update(d_aux)
+    def iteracion_de_politicas(self, evaluacion='barrido'):
+        # Con evaluación 'exacta' cada evaluación resuelve el sistema lineal de la política en lugar de hacer un barrido
+        if evaluacion == 'exacta':
+            return self.iteracion_de_politicas_exacta()
+        # Sólo se recorren los estados alcanzables desde el inicio
+        estados_posibles = [(int(fila), int(columna)) for fila, columna in self.entorno.coordenadas]
+        # Inicializamos la Tabla de Utilidades: la recompensa en los destinos y 0 (o el arranque en caliente) en el resto
+        self.u_tabla = self.utilidades_iniciales()
         # Iniciamos las iteraciones
         self.tiempo_ejecucion = time()
         for _ in range(self.num_episodios):
@@ -338,7 +1073,7 @@ class Agente:
                 # Tenemos en cuenta el siguiente estado con su probabilidad y las perpendiculares en un entorno estocástico
                 # Esto devuelve el sumatorio de la probabilidad de la acción de la política y de la % de sus perpendiculares
                 sumatorio_transicion_y_utilidad = self.transicion_y_utilidad(estado,siguiente_estado)
-                self.u_tabla[estado] = recompensa + self.gamma * sumatorio_transicion_y_utilidad
+                self.u_tabla[self.entorno.ids[estado]] = recompensa + self.gamma * sumatorio_transicion_y_utilidad
 
     def transicion_y_utilidad(self, estado, estado_siguiente):
             accion_v = (estado_siguiente[0] - estado[0], estado_siguiente[1] - estado[1])
@@ -346,58 +1081,58 @@ class Agente:
             # Por ejemplo para estocasticidad 80% -> T80%(s,a1,s1)*U(s1) + T10%(s,a2,s2)*U(s2) + T10%(s,a3,s3)*U(s3)
             # Si no es válida una perpendicular o el entorno es determinista automáticamente sólo saca un T(s,a,s')*U(s') ya que el resto es 0
             if accion_v == (-1,0): # Arriba
-                accion_1 = self.entorno.estocasticidad * self.u_tabla[estado_siguiente]
+                accion_1 = self.entorno.estocasticidad * self.u_tabla[self.entorno.ids[estado_siguiente]]
                 perpendicular_1_prob = ((1 - self.entorno.estocasticidad) / 2)
                 estado_perpendicular_1 = (estado[0], estado[1]+1) # Derecha
                 if self.entorno.es_valido(Estado(estado_perpendicular_1[0], estado_perpendicular_1[1])):
-                    accion_2 =  perpendicular_1_prob * self.u_tabla[estado_perpendicular_1]
+                    accion_2 =  perpendicular_1_prob * self.u_tabla[self.entorno.ids[estado_perpendicular_1]]
                 else:
                     accion_2 = 0
                 estado_perpendicular_2 = (estado[0], estado[1]-1) # Izquierda
                 if self.entorno.es_valido(Estado(estado_perpendicular_2[0], estado_perpendicular_2[1])):
-                    accion_3 =  perpendicular_1_prob * self.u_tabla[estado_perpendicular_2]
+                    accion_3 =  perpendicular_1_prob * self.u_tabla[self.entorno.ids[estado_perpendicular_2]]
                 else:
                     accion_3 = 0
                 return np.sum(accion_1 + accion_2 + accion_3)
             elif accion_v == (0,1): # Derecha
-                accion_1 = self.entorno.estocasticidad * self.u_tabla[estado_siguiente]
+                accion_1 = self.entorno.estocasticidad * self.u_tabla[self.entorno.ids[estado_siguiente]]
                 perpendicular_1_prob = ((1 - self.entorno.estocasticidad) / 2)
                 estado_perpendicular_1 = (estado[0]+1, estado[1]) # Abajo
                 if self.entorno.es_valido(Estado(estado_perpendicular_1[0], estado_perpendicular_1[1])):
-                    accion_2 =  perpendicular_1_prob * self.u_tabla[estado_perpendicular_1]
+                    accion_2 =  perpendicular_1_prob * self.u_tabla[self.entorno.ids[estado_perpendicular_1]]
                 else:
                     accion_2 = 0
                 estado_perpendicular_2 = (estado[0]-1, estado[1]) # Arriba
                 if self.entorno.es_valido(Estado(estado_perpendicular_2[0], estado_perpendicular_2[1])):
-                    accion_3 =  perpendicular_1_prob * self.u_tabla[estado_perpendicular_2]
+                    accion_3 =  perpendicular_1_prob * self.u_tabla[self.entorno.ids[estado_perpendicular_2]]
                 else:
                     accion_3 = 0
                 return np.sum(accion_1 + accion_2 + accion_3)
             elif accion_v == (1,0): # Abajo
-                accion_1 = self.entorno.estocasticidad * self.u_tabla[estado_siguiente]
+                accion_1 = self.entorno.estocasticidad * self.u_tabla[self.entorno.ids[estado_siguiente]]
                 perpendicular_1_prob = ((1 - self.entorno.estocasticidad) / 2)
                 estado_perpendicular_1 = (estado[0], estado[1] + 1) # Derecha
                 if self.entorno.es_valido(Estado(estado_perpendicular_1[0], estado_perpendicular_1[1])):
-                    accion_2 =  perpendicular_1_prob * self.u_tabla[estado_perpendicular_1]
+                    accion_2 =  perpendicular_1_prob * self.u_tabla[self.entorno.ids[estado_perpendicular_1]]
                 else:
                     accion_2 = 0
                 estado_perpendicular_2 = (estado[0], estado[1] - 1) # Izquierda
                 if self.entorno.es_valido(Estado(estado_perpendicular_2[0], estado_perpendicular_2[1])):
-                    accion_3 =  perpendicular_1_prob * self.u_tabla[estado_perpendicular_2]
+                    accion_3 =  perpendicular_1_prob * self.u_tabla[self.entorno.ids[estado_perpendicular_2]]
                 else:
                     accion_3 = 0
                 return np.sum(accion_1 + accion_2 + accion_3)
             else: # Izquierda
-                accion_1 = self.entorno.estocasticidad * self.u_tabla[estado_siguiente]
+                accion_1 = self.entorno.estocasticidad * self.u_tabla[self.entorno.ids[estado_siguiente]]
                 perpendicular_1_prob = ((1 - self.entorno.estocasticidad) / 2)
                 estado_perpendicular_1 = (estado[0] + 1, estado[1]) # Abajo
                 if self.entorno.es_valido(Estado(estado_perpendicular_1[0], estado_perpendicular_1[1])):
-                    accion_2 =  perpendicular_1_prob * self.u_tabla[estado_perpendicular_1]
+                    accion_2 =  perpendicular_1_prob * self.u_tabla[self.entorno.ids[estado_perpendicular_1]]
                 else:
                     accion_2 = 0
                 estado_perpendicular_2 = (estado[0] - 1, estado[1]) # Arriba
                 if self.entorno.es_valido(Estado(estado_perpendicular_2[0], estado_perpendicular_2[1])):
-                    accion_3 =  perpendicular_1_prob * self.u_tabla[estado_perpendicular_2]
+                    accion_3 =  perpendicular_1_prob * self.u_tabla[self.entorno.ids[estado_perpendicular_2]]
                 else:
                     accion_3 = 0
                 return np.sum(accion_1 + accion_2 + accion_3)
@@ -407,11 +1142,10 @@ class Agente:
         max_estado = None
         # Valor de mejora iniciado a menos infinito
         valor = float('-inf')
-        estados_posibles = [(fila, columna) for fila in range(self.entorno.filas) for columna in
-                            range(self.entorno.columnas)]
+        estados_posibles = [(int(fila), int(columna)) for fila, columna in self.entorno.coordenadas]
 
         for estado in estados_posibles:
-            if estado not in self.entorno.destinos and estado not in self.entorno.peligros_fatales and estado not in self.entorno.bloqueados:
+            if estado not in self.entorno.destinos and estado not in self.entorno.peligros_fatales:
                 # Miramos los sucesores de ese estado, es decir, transiciones válidas en el entorno
                 sucesores = self.sucesores(estado)
                 for nuevo_estado in sucesores:
@@ -458,6 +1192,340 @@ class Agente:
         siguiente_estado = (nueva_fila, nueva_columna)
         return siguiente_estado
 
+    # Utilidades con las que empiezan los planificadores: las del arranque en caliente si se ha hecho
+    # o, como en iteracion_de_politicas, la recompensa en los destinos y 0 en el resto
+    def utilidades_iniciales(self):
+        if self.u_inicial is not None:
+            return self.u_inicial.copy()
+        return np.where(self.entorno.terminales, self.entorno.recompensas, 0.0)
+
+    # Arranque en caliente: estimación de las utilidades por distancia descontada a las personas atrapadas
+    # Se recorre el mapa hacia atrás desde los destinos con Dijkstra, maximizando U(s) = R(s) + gamma * U(vecino)
+    # sin atravesar destinos ni peligros fatales (que conservan su recompensa). Las celdas sin camino se quedan en 0
+    # Esas utilidades son las de partida del resto de planificadores hasta llamar a descartar_arranque
+    # Con sembrar_qtabla también se siembra la Q Tabla, Q(s,a) = sumatorio T(s,a,s') * U(s'), sustituyendo
+    # lo aprendido hasta ahora
+    def arranque_en_caliente(self, sembrar_qtabla=True):
+        recompensas = self.entorno.recompensas.tolist()
+        terminales = self.entorno.terminales.tolist()
+        siguientes = self.entorno.siguientes.tolist()
+        perpendiculares = Entorno.perpendiculares.tolist()
+        probabilidad, probabilidad_perpendicular, _ = self.entorno.probabilidades.tolist()
+        estimaciones = np.where(self.entorno.terminales, self.entorno.recompensas, -np.inf).tolist()
+        alcanzados = [False] * self.entorno.num_estados
+        cola = []
+        for fila, columna in self.entorno.destinos:
+            estado = int(self.entorno.ids[fila, columna])
+            # Los destinos inalcanzables desde el inicio no tienen identificador (-1)
+            if estado >= 0:
+                cola.append((-recompensas[estado], estado))
+        heapq.heapify(cola)
+        while cola:
+            valor, estado = heapq.heappop(cola)
+            if alcanzados[estado]:
+                continue
+            alcanzados[estado] = True
+            for vecino in siguientes[estado]:
+                if terminales[vecino] or alcanzados[vecino]:
+                    continue
+                # Acción del vecino que lleva a este estado, sus perpendiculares cuentan con la estimación que ya tengan
+                # (los peligros fatales con su recompensa) y, si aún no la tienen, con la del propio estado
+                accion = siguientes[vecino].index(estado)
+                laterales = [siguientes[vecino][perpendicular] for perpendicular in perpendiculares[accion]]
+                candidato = recompensas[vecino] + self.gamma * (probabilidad * -valor + probabilidad_perpendicular * sum(
+                    estimaciones[lateral] if alcanzados[lateral] or terminales[lateral] else -valor
+                    for lateral in laterales))
+                if candidato > estimaciones[vecino]:
+                    estimaciones[vecino] = candidato
+                    heapq.heappush(cola, (-candidato, vecino))
+        self.u_inicial = np.array(estimaciones)
+        self.u_inicial[np.isneginf(self.u_inicial)] = 0.0
+        if sembrar_qtabla:
+            self.qtabla = self.valores_accion(self.u_inicial)
+        return self.u_inicial
+
+    # Deshace arranque_en_caliente y arranque_desde_qtabla: los planificadores vuelven a empezar en frío
+    # La Q Tabla no se toca, si se sembró sigue con lo aprendido desde entonces
+    def descartar_arranque(self):
+        self.u_inicial = None
+
+    # Utilidades de la Q Tabla: U(s) = R(s) + gamma * max_a Q(s,a), y R(s) en los terminales
+    # y en los estados sin ninguna acción válida
+    # Es la inversa de Q(s,a) = sumatorio T(s,a,s') * U(s'), ya que la Q Tabla recibe la recompensa al llegar a s'
+    def utilidades_desde_qtabla(self):
+        validas = self.entorno.acciones_validas
+        mejores = np.where(validas, self.qtabla, -np.inf).max(axis=1)
+        sin_acciones = self.entorno.terminales | ~validas.any(axis=1)
+        return np.where(sin_acciones, self.entorno.recompensas,
+                        self.entorno.recompensas + self.gamma * mejores)
+
+    # Arranque de los planificadores con lo aprendido por QLearning: las utilidades de la Q Tabla como utilidades
+    # iniciales y su política voraz como política inicial de la iteración de políticas
+    # Es una foto de la Q Tabla actual, tras seguir aprendiendo hay que volver a llamarlo o llamar a descartar_arranque
+    def arranque_desde_qtabla(self):
+        self.u_inicial = self.utilidades_desde_qtabla()
+        self.politica = self.indices_a_politica(self.politica_determinista())
+        return self.u_inicial
+
+    # Arranque de QLearning con las utilidades de un planificador (por defecto las de la última planificación):
+    # Q(s,a) = sumatorio T(s,a,s') * U(s'), el aprendizaje continúa desde esos valores
+    def arranque_desde_utilidades(self, u=None):
+        self.qtabla = self.valores_accion(self.u_tabla if u is None else u)
+        return self.qtabla
+
+    # Iteración de políticas sobre el modelo tabular del entorno
+    # La evaluación resuelve directamente (I - gamma * P) U = R para la política actual
+    def iteracion_de_politicas_exacta(self, max_iteraciones=1000):
+        self.tiempo_ejecucion = time()
+        politica = self.politica_a_indices(self.politica)
+        u = self.utilidades_iniciales()
+        self.num_iteraciones = 0
+        while self.num_iteraciones < max_iteraciones:
+            self.num_iteraciones += 1
+            u = self.evaluacion_exacta(politica, u)
+            nueva_politica = self.mejora_politica_exacta(politica, u)
+            # Si la política no cambia, la evaluación ya es la de la política óptima
+            if np.array_equal(nueva_politica, politica):
+                break
+            politica = nueva_politica
+        self.tiempo_ejecucion = time() - self.tiempo_ejecucion
+        self.u_tabla = u
+        self.politica = self.indices_a_politica(politica)
+        self.estadisticas(True, "ITERACIÓN DE POLÍTICAS EXACTA")
+        return self.politica
+
+    # Iteración de políticas modificada: k barridos de evaluación por cada mejora en lugar de evaluar hasta converger
+    # Con adaptativa=True se evalúa hasta que el residuo de la evaluación baja de una fracción del residuo de Bellman
+    # de la ronda anterior (con barridos como máximo). Termina cuando la política es estable y el residuo < umbral
+    def iteracion_de_politicas_modificada(self, barridos=5, adaptativa=False, umbral=1e-6, max_rondas=100000):
+        self.tiempo_ejecucion = time()
+        politica = self.politica_a_indices(self.politica)
+        u = self.utilidades_iniciales()
+        estados = np.arange(self.entorno.num_estados)[:, None]
+        tolerancia = umbral
+        self.num_iteraciones = 0
+        self.num_barridos = 0
+        while self.num_iteraciones < max_rondas:
+            self.num_iteraciones += 1
+            # Tabla de sucesores de la política actual con la acción elegida y sus perpendiculares, fija durante la ronda
+            acciones = np.column_stack([politica, Entorno.perpendiculares[politica]])
+            sucesores = self.entorno.siguientes[estados, acciones]
+            for _ in range(barridos if barridos > 0 else 1):
+                self.num_barridos += 1
+                nueva_u = np.where(self.entorno.terminales, self.entorno.recompensas,
+                                   self.entorno.recompensas + self.gamma * (u[sucesores] @ self.entorno.probabilidades))
+                residuo_evaluacion = np.max(np.abs(nueva_u - u))
+                u = nueva_u
+                if adaptativa and residuo_evaluacion < tolerancia:
+                    break
+            self.residuo = float(np.max(np.abs(self.actualizacion_bellman(u) - u)))
+            tolerancia = max(umbral, 0.1 * self.residuo)
+            nueva_politica = self.mejora_politica_exacta(politica, u)
+            estable = np.array_equal(nueva_politica, politica)
+            politica = nueva_politica
+            if estable and self.residuo < umbral:
+                break
+        self.tiempo_ejecucion = time() - self.tiempo_ejecucion
+        self.u_tabla = u
+        self.politica = self.indices_a_politica(politica)
+        self.estadisticas(True, "ITERACIÓN DE POLÍTICAS MODIFICADA")
+        return self.politica
+
+    # Iteración de valores sobre todo el mapa a la vez, termina cuando el residuo de Bellman es menor que el umbral
+    def iteracion_de_valores(self, umbral=1e-6, max_iteraciones=100000):
+        self.tiempo_ejecucion = time()
+        u = self.utilidades_iniciales()
+        self.num_iteraciones = 0
+        while self.num_iteraciones < max_iteraciones:
+            self.num_iteraciones += 1
+            nueva_u = self.actualizacion_bellman(u)
+            self.residuo = float(np.max(np.abs(nueva_u - u)))
+            u = nueva_u
+            if self.residuo < umbral:
+                break
+        self.tiempo_ejecucion = time() - self.tiempo_ejecucion
+        self.u_tabla = u
+        self.politica = self.indices_a_politica(self.politica_voraz(self.valores_accion(u)))
+        self.estadisticas(True, "ITERACIÓN DE VALORES")
+        return self.politica
+
+    # Actualización de Bellman de todos los estados (o sólo de los indicados): U(s) = R(s) + gamma * max_a sumatorio T(s,a,s') * U(s')
+    # Los estados terminales conservan su recompensa y los que no tienen acciones válidas se quedan en el sitio
+    def actualizacion_bellman(self, u, estados=None):
+        estados = slice(None) if estados is None else estados
+        validas = self.entorno.acciones_validas[estados]
+        valores = np.where(validas, self.valores_accion(u, estados), -np.inf)
+        mejor_valor = np.where(validas.any(axis=1), valores.max(axis=1), u[estados])
+        return np.where(self.entorno.terminales[estados], self.entorno.recompensas[estados],
+                        self.entorno.recompensas[estados] + self.gamma * mejor_valor)
+
+    # Barrido priorizado: en lugar de recorrer todos los estados se actualiza primero el de mayor prioridad.
+    # Al cambiar U(s) en delta, cada predecesor p suma gamma * max_a P(s | p, a) * |delta| a su prioridad, que es
+    # una cota de su error de Bellman, sin tener que hacer su actualización completa para calcularlo
+    # num_actualizaciones cuenta todas las actualizaciones de Bellman, incluidos los barridos completos inicial y final
+    # Cada actualización es de un único estado, así que se trabaja con listas de Python en lugar de arrays
+    def barrido_priorizado(self, umbral=1e-6, max_actualizaciones=None):
+        self.tiempo_ejecucion = time()
+        u = self.utilidades_iniciales()
+        inicio_predecesores, predecesores, probabilidades_predecesores = self.entorno.indice_predecesores()
+        prioridades = np.abs(self.actualizacion_bellman(u) - u)
+        cola = [(-prioridad, estado) for estado, prioridad in enumerate(prioridades.tolist()) if prioridad > umbral]
+        heapq.heapify(cola)
+
+        u = u.tolist()
+        prioridades = prioridades.tolist()
+        inicio_predecesores = inicio_predecesores.tolist()
+        predecesores = predecesores.tolist()
+        pesos_predecesores = (self.gamma * probabilidades_predecesores).tolist()
+        siguientes = self.entorno.siguientes.tolist()
+        acciones_validas = [np.flatnonzero(validas).tolist() for validas in self.entorno.acciones_validas]
+        recompensas = self.entorno.recompensas.tolist()
+        perpendiculares = Entorno.perpendiculares.tolist()
+        probabilidad, probabilidad_perpendicular, _ = self.entorno.probabilidades.tolist()
+
+        def respaldo(estado):
+            sig = siguientes[estado]
+            valores = [probabilidad * u[sig[accion]] + probabilidad_perpendicular * (
+                u[sig[perpendiculares[accion][0]]] + u[sig[perpendiculares[accion][1]]])
+                       for accion in acciones_validas[estado]]
+            return recompensas[estado] + self.gamma * (max(valores) if valores else u[estado])
+
+        # Prioridad con la que está encolado cada estado, 0 si no lo está. Para no llenar la cola de entradas antiguas
+        # un estado ya encolado sólo se vuelve a encolar cuando su prioridad al menos se duplica
+        encolados = [0.0] * len(u)
+        for prioridad, estado in cola:
+            encolados[estado] = -prioridad
+        self.num_actualizaciones = self.entorno.num_estados
+        while cola and (max_actualizaciones is None or self.num_actualizaciones < max_actualizaciones):
+            prioridad, estado = heapq.heappop(cola)
+            # Entradas antiguas de un estado que ya se actualizó o que se volvió a encolar con más prioridad
+            if -prioridad != encolados[estado]:
+                continue
+            nuevo_valor = respaldo(estado)
+            cambio = abs(nuevo_valor - u[estado])
+            u[estado] = nuevo_valor
+            prioridades[estado] = 0.0
+            encolados[estado] = 0.0
+            self.num_actualizaciones += 1
+            # El cambio se propaga a la prioridad de los predecesores, se encolan los que superan el umbral
+            for posicion in range(inicio_predecesores[estado], inicio_predecesores[estado + 1]):
+                anterior = predecesores[posicion]
+                prioridad = prioridades[anterior] + pesos_predecesores[posicion] * cambio
+                prioridades[anterior] = prioridad
+                if prioridad > umbral and prioridad > 2.0 * encolados[anterior]:
+                    encolados[anterior] = prioridad
+                    heapq.heappush(cola, (-prioridad, anterior))
+        u = np.array(u)
+        self.residuo = float(np.max(np.abs(self.actualizacion_bellman(u) - u)))
+        self.num_actualizaciones += self.entorno.num_estados
+        self.tiempo_ejecucion = time() - self.tiempo_ejecucion
+        self.num_iteraciones = self.num_actualizaciones
+        self.u_tabla = u
+        self.politica = self.indices_a_politica(self.politica_voraz(self.valores_accion(u)))
+        self.estadisticas(True, "BARRIDO PRIORIZADO")
+        return self.politica
+
+    # Matriz dispersa de transición de una política con la acción elegida y sus dos perpendiculares
+    # Las filas de los estados terminales quedan vacías, por lo que su utilidad es directamente su recompensa
+    def matriz_transicion(self, politica):
+        no_terminales = np.flatnonzero(~self.entorno.terminales)
+        acciones = politica[no_terminales]
+        perpendiculares = Entorno.perpendiculares[acciones]
+        siguientes = self.entorno.siguientes[no_terminales]
+        filas = np.tile(no_terminales, 3)
+        columnas = np.concatenate([siguientes[np.arange(len(no_terminales)), acciones],
+                                   siguientes[np.arange(len(no_terminales)), perpendiculares[:, 0]],
+                                   siguientes[np.arange(len(no_terminales)), perpendiculares[:, 1]]])
+        datos = np.repeat(self.entorno.probabilidades, len(no_terminales))
+        # Las entradas repetidas (por ejemplo, al chocar contra un muro) se suman al construir la matriz
+        num_estados = self.entorno.num_estados
+        return sparse.csr_matrix((datos, (filas, columnas)), shape=(num_estados, num_estados))
+
+    # Evaluación exacta de una política, en mapas grandes se usa BiCGSTAB con precondicionador de Jacobi
+    # partiendo de las utilidades de la iteración anterior
+    def evaluacion_exacta(self, politica, u_anterior):
+        num_estados = self.entorno.num_estados
+        sistema = sparse.identity(num_estados, format='csr') - self.gamma * self.matriz_transicion(politica)
+        if num_estados <= self.umbral_resolvedor_directo:
+            return spsolve(sistema.tocsc(), self.entorno.recompensas)
+        precondicionador = sparse.diags(1.0 / sistema.diagonal())
+        u, info = bicgstab(sistema, self.entorno.recompensas, x0=u_anterior, rtol=0.0,
+                           atol=self.tolerancia_resolvedor, M=precondicionador)
+        if info != 0:
+            raise RuntimeError('BiCGSTAB no ha convergido en la evaluación exacta (info = {})'.format(info))
+        return u
+
+    # Mejora de la política a partir de las utilidades, sólo se cambia la acción si la nueva es estrictamente mejor
+    def mejora_politica_exacta(self, politica, u):
+        valores = self.valores_accion(u)
+        mejores = self.politica_voraz(valores)
+        filas = np.arange(self.entorno.num_estados)
+        mejora = valores[filas, mejores] > valores[filas, politica] + 1e-10
+        return np.where(mejora, mejores, politica)
+
+    # Valor de cada acción en cada estado, sumatorio de T(s,a,s') * U(s') con la acción y sus perpendiculares
+    def valores_accion(self, u, estados=None):
+        vecinos = u[self.entorno.siguientes if estados is None else self.entorno.siguientes[estados]]
+        probabilidades = self.entorno.probabilidades
+        return probabilidades[0] * vecinos + probabilidades[1] * (vecinos[:, Entorno.perpendiculares[:, 0]] +
+                                                                  vecinos[:, Entorno.perpendiculares[:, 1]])
+
+    # Acción de mayor valor en cada estado descartando las acciones no válidas
+    def politica_voraz(self, valores):
+        return np.argmax(np.where(self.entorno.acciones_validas, valores, -np.inf), axis=1)
+
+    # Conversión de la política en formato diccionario a un array con el índice de la acción de cada estado
+    # Los estados sin acción en la política toman su primera acción válida y las celdas inalcanzables se ignoran
+    def politica_a_indices(self, politica):
+        indices = self.politica_voraz(np.zeros((self.entorno.num_estados, len(self.mov_numericos))))
+        if politica:
+            acciones = {direccion: accion for accion, direccion in self.direcciones.items()}
+            for (fila, columna), direccion in politica.items():
+                if self.entorno.ids[fila, columna] >= 0:
+                    indices[self.entorno.ids[fila, columna]] = acciones[direccion]
+        return indices
+
+    # Conversión inversa, sólo para los estados que no son destinos
+    def indices_a_politica(self, indices):
+        return {(int(fila), int(columna)): self.direcciones[int(accion)] for (fila, columna), accion, terminal in
+                zip(self.entorno.coordenadas, indices, self.entorno.terminales) if not terminal}
+
+    # Política actual como matriz del mapa con el índice de la acción de cada celda, -1 en bloqueadas y destinos
+    def politica_a_matriz(self):
+        matriz = np.full((self.entorno.filas, self.entorno.columnas), -1)
+        no_terminales = ~self.entorno.terminales
+        coordenadas = self.entorno.coordenadas[no_terminales]
+        matriz[coordenadas[:, 0], coordenadas[:, 1]] = self.politica_a_indices(self.politica)[no_terminales]
+        return matriz
+
+    def utilidades_a_diccionario(self, u):
+        return {(int(fila), int(columna)): float(valor) for (fila, columna), valor in zip(self.entorno.coordenadas, u)}
+
+
+
+# Proceso de ejecutar_algoritmo_asincrono: ejecuta sus episodios sobre la Q Tabla en memoria compartida hasta acabarlos
+# o hasta que el proceso principal activa parada, y va publicando sus episodios y pasos en contadores
+# configuracion son el json y los parámetros del Entorno y parametros los del Agente
+def proceso_asincrono(configuracion, parametros, nombre_memoria, contadores, indice, num_episodios, semilla, epsilon,
+                      max_pasos, parada):
+    agente = Agente(Entorno(*configuracion), parametros['alpha'], parametros['gamma'], epsilon,
+                    parametros['decaimiento_epsilon'], None, parametros['decaimiento_alpha'])
+    agente.alpha_inicial = parametros['alpha_inicial']
+    agente.num_episodios = parametros['num_episodios']
+    memoria = shared_memory.SharedMemory(name=nombre_memoria)
+    try:
+        agente.qtabla = np.ndarray(agente.qtabla.shape, dtype=agente.qtabla.dtype, buffer=memoria.buf)
+        generador = np.random.default_rng(semilla)
+        for i in range(num_episodios):
+            if parada.is_set():
+                break
+            agente.episodio_modelo(generador, max_pasos)
+            contadores[2 * indice] = i + 1
+            contadores[2 * indice + 1] = agente.num_pasos
+    finally:
+        # La vista sobre la memoria compartida debe liberarse antes de cerrarla
+        agente.qtabla = None
+        memoria.close()
 
 
 if __name__ == '__main__':
@@ -465,7 +1533,7 @@ if __name__ == '__main__':
     archivo_json = './initial-rl-instances/lesson5-rl.json'
     # archivo_json = './initial-rl-instances/instance-10-10-12-4-11-1111--rl.json'
     # archivo_json = ...
-    # Parámetro necesario para dibujar la política
+    # Ruta del json, sólo se usa para nombrar la imagen de la política y los ficheros del informe
     json_dir = os.path.join(os.getcwd(), archivo_json)
     # Inicializamos los parámetros
     penalizacion_entorno = -0.04
@@ -477,6 +1545,9 @@ if __name__ == '__main__':
     epsilon = 0.3
     decaimiento_epsilon = 0.05
     decaimiento_alpha = 0.999
+    # Con True la iteración de políticas parte de las utilidades y la política aprendidas por QLearning
+    # en lugar de empezar en frío (la comparación de ambos arranques está en benchmark.comparar_hibrido)
+    arranque_desde_qlearning = False
 
     print("***************************************************************************************")
     print(f"Penalización del entorno: {penalizacion_entorno}")
@@ -498,66 +1569,8 @@ if __name__ == '__main__':
     # Ejecutamos el Algoritmo con el nº de episodios y obtenemos la política y la imprimimos
     # Posteriormente la dibujamos
     agente.ejecutar_algoritmo(numero_episodios)
+    if arranque_desde_qlearning:
+        agente.arranque_desde_qtabla()
     agente.iteracion_de_politicas()
 
-'''if __name__ == '__main__':
-    # Cargamos el json, descomentar el deseado o introducir otro
-    archivo_json = './initial-rl-instances/lesson5-rl.json'
-    # archivo_json = './initial-rl-instances/instance-10-10-12-4-11-1111--rl.json'
-    # archivo_json = ...
-
-    # Parámetro necesario para dibujar la política
-    json_dir = os.path.join(os.getcwd(), archivo_json)
-
-    
-    # Inicializamos los parámetros en formato de vector para generar semillas
-    penalizacion_entorno = [-0.04, -0.5, -5]
-    penalizacion_peligro = [-5, -1, -10]
-    estocasticidad_entorno = [0.7, 0.8, 0.9]
-    numero_episodios = [100, 500, 1000]
-    alpha = [0.2, 0.5, 0.9]
-    gamma = [0.9, 0.5, 0.2]
-    epsilon = [0.2, 0.3, 0.5]
-    decaimiento_epsilon = [0.05, 0.01, 0.02, 0.005]
-    decaimiento_alpha = [0.999, 0.995, 0.99]
-
-    # Generamos hasta 5 semillas
-    semillas = random.sample(list(itertools.product(
-        penalizacion_entorno,
-        penalizacion_peligro,
-        estocasticidad_entorno,
-        numero_episodios,
-        alpha,
-        gamma,
-        epsilon,
-        decaimiento_epsilon,
-        decaimiento_alpha
-    )),
-    5 # Con esto controlamos el número de semillas a utilizar para los test
-    )
-    # Iterar sobre las semillas en cada llamada
-    for i, semilla in enumerate(semillas):
-        penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno, numero_episodios, alpha, gamma, epsilon, decaimiento_epsilon, decaimiento_alpha = semilla
-        
-        print(f"----SEMILLA {i + 1}----")
-        print("\n")
-        print(f"Penalización del entorno: {penalizacion_entorno}")
-        print(f"Penalización de peligro: {penalizacion_peligro}")
-        print(f"Estocasticidad del entorno: {estocasticidad_entorno}")
-        print(f"Número de episodios: {numero_episodios}")
-        print(f"Alpha: {alpha}")
-        print(f"Gamma: {gamma}")
-        print(f"Epsilon: {epsilon}")
-        print(f"Decaimiento de epsilon: {decaimiento_epsilon}")
-        print(f"Decaimiento de alpha: {decaimiento_alpha}")
-        print("\n")
-
-        # Llamar a Entorno y Agente con las semillas correspondientes
-        entorno = Entorno(archivo_json, penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno)
-        agente = Agente(entorno, alpha, gamma, epsilon, decaimiento_epsilon, json_dir, decaimiento_alpha)
-        agente.ejecutar_algoritmo(numero_episodios)
-        # Parte correspondiente a la evaluación extraordinaria 
-        agente.iteracion_de_politicas()
-        print("\n")
-
-'''
\ No newline at end of file
+# El barrido de combinaciones de parámetros se encuentra en barrido_parametros.py
@@ -0,0 +1,122 @@
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from Lab2 import Agente, Entorno
+
+# Entorno de cada proceso del barrido, el json se lee una única vez al arrancar el proceso
+# y en cada combinación sólo se cambian las penalizaciones y la estocasticidad
+entorno_proceso = None
+# Utilidades y políticas de referencia ya calculadas en el proceso para cada configuración del entorno
+referencias_proceso = {}
+# Episodios y límite de pasos de la evaluación de Monte Carlo de cada política aprendida
+episodios_evaluacion = 5000
+max_pasos_evaluacion = 1000
+
+
+def inicializar_proceso(archivo_json):
+    global entorno_proceso
+    # Los parámetros se sobrescriben con configurar en cada combinación
+    entorno_proceso = Entorno(archivo_json, -0.04, -5, 0.8)
+    referencias_proceso.clear()
+
+
+# Política de referencia obtenida con iteración de valores para la configuración actual del entorno
+# Se usa para medir la calidad de la política aprendida con QLearning
+def obtener_referencia(gamma):
+    clave = (entorno_proceso.penalizacion, entorno_proceso.penalizacion_peligro, entorno_proceso.estocasticidad, gamma)
+    if clave not in referencias_proceso:
+        planificador = Agente(entorno_proceso, 0, gamma, 0, 0, None, 0)
+        planificador.modo_informe = None
+        planificador.iteracion_de_valores()
+        inicio = entorno_proceso.ids[entorno_proceso.inicio.fila, entorno_proceso.inicio.columna]
+        referencias_proceso[clave] = (planificador.politica, planificador.u_tabla[inicio])
+    return referencias_proceso[clave]
+
+
+# Ejecuta QLearning con una combinación de parámetros sin imprimir ni dibujar nada y devuelve su fila de resultados
+def ejecutar_combinacion(combinacion, semilla):
+    penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno, numero_episodios, alpha, gamma, epsilon, \
+        decaimiento_epsilon, decaimiento_alpha = combinacion
+    np.random.seed(semilla)
+    entorno_proceso.configurar(penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno)
+    agente = Agente(entorno_proceso, alpha, gamma, epsilon, decaimiento_epsilon, None, decaimiento_alpha)
+    agente.modo_informe = None
+    politica = agente.ejecutar_algoritmo(numero_episodios)
+
+    politica_referencia, utilidad_optima = obtener_referencia(gamma)
+    coincidencia = np.mean([politica[estado] == accion for estado, accion in politica_referencia.items()])
+    # Utilidad exacta de la política aprendida en el estado inicial, comparable con la de la política óptima
+    utilidades = agente.evaluacion_exacta(agente.politica_a_indices(politica), None)
+    utilidad_inicio = utilidades[entorno_proceso.ids[entorno_proceso.inicio.fila, entorno_proceso.inicio.columna]]
+    evaluacion = agente.evaluacion_montecarlo(politica, episodios_evaluacion, max_pasos_evaluacion, semilla)
+    return {
+        'penalizacion_entorno': penalizacion_entorno,
+        'penalizacion_peligro': penalizacion_peligro,
+        'estocasticidad': estocasticidad_entorno,
+        'numero_episodios': numero_episodios,
+        'alpha': alpha,
+        'gamma': gamma,
+        'epsilon': epsilon,
+        'decaimiento_epsilon': decaimiento_epsilon,
+        'decaimiento_alpha': decaimiento_alpha,
+        'semilla': semilla,
+        'tiempo': agente.tiempo_ejecucion,
+        'retorno_final': agente.retorno_final,
+        'coincidencia_politica': coincidencia,
+        'utilidad_inicio': utilidad_inicio,
+        'utilidad_optima': utilidad_optima,
+        **evaluacion,
+    }
+
+
+# Reparte las combinaciones entre numero_procesos procesos, cada uno con su propio entorno ya cargado
+# Devuelve la tabla de resultados en el mismo orden que las combinaciones
+def barrido(archivo_json, combinaciones, numero_procesos=None, semilla=0):
+    semillas = [semilla + i for i in range(len(combinaciones))]
+    inicio = time()
+    with ProcessPoolExecutor(max_workers=numero_procesos, initializer=inicializar_proceso,
+                             initargs=(archivo_json,)) as procesos:
+        filas = list(procesos.map(ejecutar_combinacion, combinaciones, semillas))
+    resultados = pd.DataFrame(filas)
+    resultados.attrs['tiempo_total'] = time() - inicio
+    return resultados
+
+
+if __name__ == '__main__':
+    # MODIFICAR ESTOS VALORES PARA LANZAR EL BARRIDO ##################################################
+    archivo_json = './initial-rl-instances/lesson5-rl.json'
+    # archivo_json = './initial-rl-instances/instance-10-10-12-4-11-1111--rl.json'
+
+    penalizacion_entorno = [-0.04, -0.5, -5]
+    penalizacion_peligro = [-5, -1, -10]
+    estocasticidad_entorno = [0.7, 0.8, 0.9]
+    numero_episodios = [100, 500, 1000]
+    alpha = [0.2, 0.5, 0.9]
+    gamma = [0.9, 0.5, 0.2]
+    epsilon = [0.2, 0.3, 0.5]
+    decaimiento_epsilon = [0.05, 0.01, 0.02, 0.005]
+    decaimiento_alpha = [0.999, 0.995, 0.99]
+
+    # Número de combinaciones elegidas al azar, None para recorrerlas todas
+    numero_muestras = 20
+    numero_procesos = os.cpu_count()
+    semilla = 0
+    archivo_resultados = 'resultados_barrido.csv'
+    ###################################################################################################
+
+    combinaciones = list(itertools.product(penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno,
+                                           numero_episodios, alpha, gamma, epsilon, decaimiento_epsilon,
+                                           decaimiento_alpha))
+    if numero_muestras is not None:
+        combinaciones = random.Random(semilla).sample(combinaciones, numero_muestras)
+
+    resultados = barrido(archivo_json, combinaciones, numero_procesos, semilla)
+    resultados.to_csv(archivo_resultados, index=False)
+    print(f"{len(combinaciones)} combinaciones en {resultados.attrs['tiempo_total']:.2f} segundos")
+    print(f"Resultados guardados en {archivo_resultados}")
@@ -0,0 +1,453 @@
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from Lab2 import Agente, Entorno
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Parámetros comunes de las comparaciones
+penalizacion_entorno = -0.04
+penalizacion_peligro = -5
+estocasticidad_entorno = 0.8
+alpha = 0.2
+gamma = 0.9
+epsilon = 0.3
+decaimiento_epsilon = 0.99
+decaimiento_alpha = 0.999
+
+
+def crear_agente(entorno):
+    agente = Agente(entorno, alpha, gamma, epsilon, decaimiento_epsilon, None, decaimiento_alpha)
+    agente.modo_informe = None
+    return agente
+
+
+# Utilidad óptima del estado inicial, calculada con iteración de valores
+def utilidad_optima(entorno):
+    planificador = crear_agente(entorno)
+    planificador.iteracion_de_valores()
+    return planificador.u_tabla[entorno.ids[entorno.inicio.fila, entorno.inicio.columna]]
+
+
+# Utilidad exacta en el estado inicial de la política voraz actual del agente
+def utilidad_politica(agente):
+    politica = agente.obtener_politica()
+    utilidades = agente.evaluacion_exacta(agente.politica_a_indices(politica), None)
+    return utilidades[agente.entorno.ids[agente.entorno.inicio.fila, agente.entorno.inicio.columna]]
+
+
+# Ejecuta episodios hasta que la política voraz alcanza en el inicio una utilidad a menos de tolerancia (relativa)
+# de la óptima, comprobándolo cada frecuencia episodios. Devuelve el número de episodios o None si no converge
+def episodios_hasta_convergencia(agente, ejecutar_episodio, optima, max_episodios, tolerancia=0.05, frecuencia=10):
+    agente.num_episodios = max_episodios
+    for episodio in range(1, max_episodios + 1):
+        ejecutar_episodio()
+        if episodio % frecuencia == 0 and optima - utilidad_politica(agente) <= tolerancia * abs(optima):
+            return episodio
+    return None
+
+
+# Compara el aprendizaje de un paso con Q(lambda) de Watkins y SARSA(lambda) en episodios hasta converger
+def comparar_trazas(archivo_json, semillas, max_episodios, max_pasos=None, lambda_traza=0.9, umbral_traza=0.01):
+    entorno = Entorno(archivo_json, penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno)
+    optima = utilidad_optima(entorno)
+    aprendices = {
+        'un_paso': lambda agente: agente.episodio(max_pasos),
+        'watkins': lambda agente: agente.episodio_trazas(lambda_traza, 'watkins', umbral_traza, max_pasos),
+        'sarsa': lambda agente: agente.episodio_trazas(lambda_traza, 'sarsa', umbral_traza, max_pasos),
+    }
+    filas = []
+    for nombre, aprendiz in aprendices.items():
+        for semilla in semillas:
+            np.random.seed(semilla)
+            agente = crear_agente(entorno)
+            episodios = episodios_hasta_convergencia(agente, lambda: aprendiz(agente), optima, max_episodios)
+            filas.append({'aprendiz': nombre, 'semilla': semilla, 'episodios': episodios, 'pasos': agente.num_pasos})
+    return pd.DataFrame(filas)
+
+
+# Compara QLearning de un paso (planificacion 0) con Dyna-Q con distintas planificaciones en episodios, pasos reales
+# y tiempo hasta converger. El tiempo es sólo el de los episodios, sin las comprobaciones de convergencia
+def comparar_dyna(archivo_json, semillas, max_episodios, max_pasos=None, lista_planificacion=(0, 5, 20)):
+    entorno = Entorno(archivo_json, penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno)
+    optima = utilidad_optima(entorno)
+    filas = []
+    for planificacion in lista_planificacion:
+        for semilla in semillas:
+            np.random.seed(semilla)
+            agente = crear_agente(entorno)
+            agente.planificacion = planificacion
+            if planificacion:
+                agente.iniciar_modelo()
+            tiempo = [0.0]
+
+            def ejecutar_episodio():
+                inicio = time()
+                agente.episodio(max_pasos)
+                tiempo[0] += time() - inicio
+
+            episodios = episodios_hasta_convergencia(agente, ejecutar_episodio, optima, max_episodios)
+            filas.append({'planificacion': planificacion, 'semilla': semilla, 'episodios': episodios,
+                          'pasos': agente.num_pasos, 'tiempo': tiempo[0]})
+    return pd.DataFrame(filas)
+
+
+# Efecto del arranque en caliente: iteraciones de los planificadores y episodios de QLearning hasta converger
+def comparar_arranque(archivo_json, semillas, max_episodios, max_pasos=None):
+    entorno = Entorno(archivo_json, penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno)
+    optima = utilidad_optima(entorno)
+    filas = []
+    for caliente in [False, True]:
+        planificador = crear_agente(entorno)
+        if caliente:
+            planificador.arranque_en_caliente(sembrar_qtabla=False)
+        planificador.iteracion_de_valores()
+        iteraciones_valores = planificador.num_iteraciones
+        planificador.iteracion_de_politicas_modificada(max_rondas=max_episodios)
+        rondas_modificada = planificador.num_iteraciones
+        for semilla in semillas:
+            np.random.seed(semilla)
+            agente = crear_agente(entorno)
+            if caliente:
+                agente.arranque_en_caliente()
+            episodios = episodios_hasta_convergencia(agente, lambda: agente.episodio(max_pasos), optima, max_episodios)
+            filas.append({'arranque_caliente': caliente, 'semilla': semilla, 'iteraciones_valores': iteraciones_valores,
+                          'rondas_modificada': rondas_modificada, 'episodios': episodios, 'pasos': agente.num_pasos})
+    return pd.DataFrame(filas)
+
+
+# Arranque cruzado entre QLearning y los planificadores frente al arranque en frío
+# En un sentido, tras episodios_previos episodios de QLearning, la iteración de políticas exacta y la modificada parten
+# de la política y las utilidades de la Q Tabla. En el otro, QLearning parte de la Q Tabla sembrada con las utilidades
+# de iteraciones_planificador iteraciones de valores. Las columnas ahorro_* son lo que se ahorra respecto al frío
+def comparar_hibrido(archivo_json, semillas, max_episodios, max_pasos=None, episodios_previos=1000,
+                     iteraciones_planificador=20, max_iteraciones=1000):
+    entorno = Entorno(archivo_json, penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno)
+    optima = utilidad_optima(entorno)
+    planificador = crear_agente(entorno)
+    planificador.iteracion_de_valores(max_iteraciones=iteraciones_planificador)
+    utilidades_planificador = planificador.u_tabla
+
+    # Iteraciones de la iteración de políticas exacta y rondas de la modificada, con o sin el arranque desde aprendiz
+    def iteraciones_planificadores(aprendiz=None):
+        iteraciones = []
+        for metodo in [lambda agente: agente.iteracion_de_politicas_exacta(max_iteraciones),
+                       lambda agente: agente.iteracion_de_politicas_modificada(max_rondas=max_iteraciones)]:
+            agente = aprendiz if aprendiz is not None else crear_agente(entorno)
+            if aprendiz is not None:
+                agente.arranque_desde_qtabla()
+            metodo(agente)
+            iteraciones.append(agente.num_iteraciones)
+        return iteraciones
+
+    exacta_frio, modificada_frio = iteraciones_planificadores()
+    filas = []
+    for semilla in semillas:
+        np.random.seed(semilla)
+        aprendiz = crear_agente(entorno)
+        aprendiz.num_episodios = episodios_previos
+        for _ in range(episodios_previos):
+            aprendiz.episodio(max_pasos)
+        exacta_sembrada, modificada_sembrada = iteraciones_planificadores(aprendiz)
+
+        episodios = []
+        for sembrado in [False, True]:
+            np.random.seed(semilla)
+            agente = crear_agente(entorno)
+            if sembrado:
+                agente.arranque_desde_utilidades(utilidades_planificador)
+            episodios.append(episodios_hasta_convergencia(agente, lambda: agente.episodio(max_pasos), optima,
+                                                          max_episodios))
+        filas.append({'semilla': semilla, 'iteraciones_exacta_frio': exacta_frio,
+                      'iteraciones_exacta_sembrada': exacta_sembrada, 'rondas_modificada_frio': modificada_frio,
+                      'rondas_modificada_sembrada': modificada_sembrada, 'episodios_frio': episodios[0],
+                      'episodios_sembrado': episodios[1]})
+    resultados = pd.DataFrame(filas)
+    resultados['ahorro_iteraciones_exacta'] = resultados['iteraciones_exacta_frio'] - \
+        resultados['iteraciones_exacta_sembrada']
+    resultados['ahorro_rondas_modificada'] = resultados['rondas_modificada_frio'] - \
+        resultados['rondas_modificada_sembrada']
+    resultados['ahorro_episodios'] = resultados['episodios_frio'] - resultados['episodios_sembrado']
+    return resultados
+
+
+# Escalado de QLearning asíncrono con el número de procesos: tiempo hasta que la política voraz no cambia durante
+# paciencia episodios (o hasta agotar episodios o presupuesto_tiempo) y calidad de la política obtenida
+# aceleracion es el tiempo con un proceso dividido entre el tiempo con num_procesos, en la misma instancia y semilla
+def comparar_asincrono(instancias, lista_procesos, semillas, max_episodios, max_pasos=None, paciencia=200,
+                       presupuesto_tiempo=300):
+    filas = []
+    for archivo_json in instancias:
+        entorno = Entorno(archivo_json, penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno)
+        planificador = crear_agente(entorno)
+        planificador.iteracion_de_valores()
+        q_referencia = planificador.valores_accion(planificador.u_tabla)
+        for num_procesos in lista_procesos:
+            for semilla in semillas:
+                agente = crear_agente(entorno)
+                agente.ejecutar_algoritmo_asincrono(max_episodios, num_procesos, semilla, max_pasos=max_pasos,
+                                                    paciencia=paciencia, presupuesto_tiempo=presupuesto_tiempo)
+                coincidencia, utilidad_inicio = calidad_politica(agente, agente.politica_determinista(), q_referencia)
+                filas.append({'instancia': os.path.splitext(os.path.basename(archivo_json))[0],
+                              'procesos': num_procesos, 'semilla': semilla, 'tiempo': agente.tiempo_ejecucion,
+                              'episodios': agente.episodios_asincronos, 'pasos': agente.num_pasos,
+                              'pasos_por_segundo': agente.num_pasos / agente.tiempo_ejecucion,
+                              'estable': agente.episodio_parada is not None, 'coincidencia_politica': coincidencia,
+                              'utilidad_inicio': utilidad_inicio})
+    resultados = pd.DataFrame(filas)
+    referencia = resultados[resultados['procesos'] == lista_procesos[0]].set_index(['instancia', 'semilla'])['tiempo']
+    resultados['aceleracion'] = [referencia[(fila.instancia, fila.semilla)] / fila.tiempo
+                                 for fila in resultados.itertuples()]
+    return resultados
+
+
+# Ficheros json de las instancias de los directorios indicados, en orden alfabético
+def listar_instancias(directorios):
+    return [os.path.join(directorio, archivo) for directorio in directorios
+            for archivo in sorted(os.listdir(directorio)) if archivo.endswith('.json')]
+
+
+# Pico de memoria residente del proceso en bytes, None en sistemas sin el módulo resource (Windows)
+# Cada caso de la suite se ejecuta en un proceso nuevo, así que es el pico de ese caso
+# ru_maxrss está en bytes en macOS y en KiB en Linux y el resto de sistemas
+def memoria_pico_proceso():
+    if resource is None:
+        return None
+    memoria = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return memoria if sys.platform == 'darwin' else memoria * 1024
+
+
+# Fracción de estados no terminales en los que la acción de la política es óptima según los valores de acción
+# de referencia (con tolerancia, para no penalizar los empates) y utilidad exacta de la política en el inicio
+def calidad_politica(agente, politica, q_referencia):
+    entorno = agente.entorno
+    no_terminales = ~entorno.terminales
+    validas = np.where(entorno.acciones_validas, q_referencia, -np.inf)
+    mejor = validas.max(axis=1)
+    elegida = q_referencia[np.arange(entorno.num_estados), politica]
+    optimas = np.isclose(elegida, mejor, rtol=1e-9, atol=1e-9)
+    utilidades = agente.evaluacion_exacta(politica, None)
+    return (float(np.mean(optimas[no_terminales])),
+            float(utilidades[entorno.ids[entorno.inicio.fila, entorno.inicio.columna]]))
+
+
+# Planificadores de la suite: cada uno con la función que lo ejecuta y la que devuelve sus iteraciones
+# y actualizaciones de estado
+planificadores = {
+    'iteracion_politicas_exacta': (lambda agente: agente.iteracion_de_politicas_exacta(),
+                                   lambda agente: (agente.num_iteraciones,
+                                                   agente.num_iteraciones * agente.entorno.num_estados)),
+    'iteracion_valores': (lambda agente: agente.iteracion_de_valores(),
+                          lambda agente: (agente.num_iteraciones, agente.num_iteraciones * agente.entorno.num_estados)),
+    'politicas_modificada': (lambda agente: agente.iteracion_de_politicas_modificada(),
+                             lambda agente: (agente.num_iteraciones, (agente.num_barridos + agente.num_iteraciones) *
+                                             agente.entorno.num_estados)),
+    'barrido_priorizado': (lambda agente: agente.barrido_priorizado(),
+                           lambda agente: (agente.num_iteraciones, agente.num_actualizaciones)),
+}
+
+# Aprendices de la suite por episodios: cada uno ejecuta un episodio del agente
+# Dyna-Q es el mismo episodio con el modelo y la planificación activados en ejecutar_caso
+aprendices = {
+    'qlearning': lambda agente, max_pasos: agente.episodio(max_pasos),
+    'dyna_q': lambda agente, max_pasos: agente.episodio(max_pasos),
+    'watkins': lambda agente, max_pasos: agente.episodio_trazas(0.9, 'watkins', 0.01, max_pasos),
+    'sarsa': lambda agente, max_pasos: agente.episodio_trazas(0.9, 'sarsa', 0.01, max_pasos),
+}
+
+
+# Ejecuta episodios hasta que la política voraz no cambia durante paciencia episodios, se agotan los episodios
+# o el presupuesto de tiempo. Devuelve el episodio en el que se considera convergida (None si no converge)
+# y el tiempo dedicado a comprobar la política, que no forma parte del aprendizaje
+def episodios_hasta_estabilidad(agente, ejecutar_episodio, num_episodios, paciencia, presupuesto_tiempo):
+    agente.num_episodios = num_episodios
+    inicio = time()
+    politica_anterior = agente.politica_determinista()
+    sin_cambios = 0
+    tiempo_comprobaciones = 0.0
+    for episodio in range(1, num_episodios + 1):
+        if time() - inicio > presupuesto_tiempo:
+            break
+        ejecutar_episodio()
+        inicio_comprobacion = time()
+        politica = agente.politica_determinista()
+        sin_cambios = sin_cambios + 1 if np.array_equal(politica, politica_anterior) else 0
+        politica_anterior = politica
+        tiempo_comprobaciones += time() - inicio_comprobacion
+        if sin_cambios >= paciencia:
+            return episodio, tiempo_comprobaciones
+    return None, tiempo_comprobaciones
+
+
+# Ejecuta un algoritmo de la suite sobre una instancia y devuelve su fila de resultados y los valores de acción
+# de referencia con los que se ha medido la calidad de su política. Si no se dan (q_referencia None),
+# el algoritmo debe ser la iteración de políticas exacta y su resultado es la propia referencia
+# pasos son los pasos en el entorno de los aprendices o las actualizaciones de estado de los planificadores
+def ejecutar_caso(archivo_json, algoritmo, semilla, q_referencia, opciones):
+    entorno = Entorno(archivo_json, penalizacion_entorno, penalizacion_peligro, estocasticidad_entorno)
+    agente = crear_agente(entorno)
+    if semilla is not None:
+        np.random.seed(semilla)
+    convergencia = None
+    inicio = time()
+    if algoritmo in planificadores:
+        planificador, contadores = planificadores[algoritmo]
+        planificador(agente)
+        tiempo = time() - inicio
+        convergencia, pasos = contadores(agente)
+        politica = agente.politica_a_indices(agente.politica)
+    elif algoritmo == 'vectorizado':
+        agente.ejecutar_algoritmo_vectorizado(opciones['episodios_vectorizado'], opciones['num_agentes'], semilla,
+                                              opciones['presupuesto_tiempo'], opciones['max_pasos'])
+        tiempo = time() - inicio
+        pasos = agente.num_pasos
+        politica = agente.politica_determinista()
+    else:
+        if algoritmo == 'dyna_q':
+            agente.planificacion = opciones['planificacion']
+            agente.iniciar_modelo()
+        convergencia, tiempo_comprobaciones = episodios_hasta_estabilidad(
+            agente, lambda: aprendices[algoritmo](agente, opciones['max_pasos']), opciones['num_episodios'],
+            opciones['paciencia'], opciones['presupuesto_tiempo'])
+        tiempo = time() - inicio - tiempo_comprobaciones
+        pasos = agente.num_pasos
+        politica = agente.politica_determinista()
+    memoria_pico = memoria_pico_proceso()
+
+    if q_referencia is None:
+        q_referencia = agente.valores_accion(agente.evaluacion_exacta(politica, None))
+    coincidencia, utilidad_inicio = calidad_politica(agente, politica, q_referencia)
+    fila = {'instancia': os.path.splitext(os.path.basename(archivo_json))[0], 'algoritmo': algoritmo,
+            'semilla': semilla, 'estados': entorno.num_estados, 'tiempo': tiempo, 'pasos': int(pasos),
+            'pasos_por_segundo': pasos / tiempo if tiempo > 0 else None, 'convergencia': convergencia,
+            'memoria_pico': memoria_pico, 'coincidencia_politica': coincidencia, 'utilidad_inicio': utilidad_inicio}
+    return fila, q_referencia
+
+
+# Ejecuta todos los planificadores y aprendices sobre cada instancia con las semillas fijas indicadas
+# La referencia de calidad de cada instancia es la iteración de políticas exacta, que se ejecuta primero
+# Cada caso se ejecuta en un proceso nuevo y de uno en uno, para que los tiempos no compitan entre sí
+# y el pico de memoria sea sólo el del caso. Con forkserver los procesos parten de un servidor pequeño;
+# creados desde este proceso heredarían su pico de memoria
+def ejecutar_suite(instancias, semillas, num_episodios=300, max_pasos=5000, paciencia=50, presupuesto_tiempo=20,
+                   planificacion=10, episodios_vectorizado=3000, num_agentes=256):
+    opciones = {'num_episodios': num_episodios, 'max_pasos': max_pasos, 'paciencia': paciencia,
+                'presupuesto_tiempo': presupuesto_tiempo, 'planificacion': planificacion,
+                'episodios_vectorizado': episodios_vectorizado, 'num_agentes': num_agentes}
+    filas = []
+    metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(metodo),
+                             max_tasks_per_child=1) as procesos:
+        for archivo_json in instancias:
+            fila, q_referencia = procesos.submit(ejecutar_caso, archivo_json, 'iteracion_politicas_exacta', None,
+                                                 None, opciones).result()
+            filas.append(fila)
+            casos = [(algoritmo, None) for algoritmo in planificadores if algoritmo != 'iteracion_politicas_exacta']
+            casos += [(algoritmo, semilla) for semilla in semillas for algoritmo in list(aprendices) + ['vectorizado']]
+            for algoritmo, semilla in casos:
+                filas.append(procesos.submit(ejecutar_caso, archivo_json, algoritmo, semilla, q_referencia,
+                                             opciones).result()[0])
+    resultados = pd.DataFrame(filas)
+    # Los planificadores no tienen semilla, así la columna sigue siendo entera
+    resultados['semilla'] = resultados['semilla'].astype('Int64')
+    return resultados
+
+
+# Guarda los resultados de la suite como referencia para comparar ejecuciones posteriores
+def guardar_referencia(resultados, archivo_referencia):
+    with open(archivo_referencia, 'w') as f:
+        json.dump(json.loads(resultados.to_json(orient='records')), f, indent=2)
+
+
+# Compara los resultados con la referencia guardada y devuelve la lista de regresiones encontradas:
+# menos pasos por segundo o más memoria que la tolerancia relativa, más iteraciones o episodios hasta converger
+# (o dejar de converger) y peor coincidencia con la política de referencia
+# Los pasos por segundo sólo se comparan en casos de al menos tiempo_minimo segundos, en los más cortos domina el ruido
+def comparar_con_referencia(resultados, archivo_referencia, tolerancia=0.4, tolerancia_coincidencia=0.05,
+                            tiempo_minimo=0.5):
+    with open(archivo_referencia, 'r') as f:
+        referencia = {(fila['instancia'], fila['algoritmo'], fila['semilla']): fila for fila in json.load(f)}
+    regresiones = []
+    for fila in json.loads(resultados.to_json(orient='records')):
+        clave = (fila['instancia'], fila['algoritmo'], fila['semilla'])
+        if clave not in referencia:
+            continue
+        base = referencia[clave]
+        descripcion = f"{clave[0]} {clave[1]} (semilla {clave[2]})"
+        if min(fila['tiempo'], base['tiempo']) >= tiempo_minimo and \
+                fila['pasos_por_segundo'] < (1 - tolerancia) * base['pasos_por_segundo']:
+            regresiones.append(f"{descripcion}: {fila['pasos_por_segundo']:.0f} pasos/s frente a "
+                               f"{base['pasos_por_segundo']:.0f}")
+        if base['memoria_pico'] and fila['memoria_pico'] and \
+                fila['memoria_pico'] > (1 + tolerancia) * base['memoria_pico']:
+            regresiones.append(f"{descripcion}: pico de memoria de {fila['memoria_pico']} bytes frente a "
+                               f"{base['memoria_pico']}")
+        if base['convergencia'] is not None and (fila['convergencia'] is None or
+                                                 fila['convergencia'] > (1 + tolerancia) * base['convergencia']):
+            regresiones.append(f"{descripcion}: convergencia en {fila['convergencia']} frente a {base['convergencia']}")
+        if fila['coincidencia_politica'] < base['coincidencia_politica'] - tolerancia_coincidencia:
+            regresiones.append(f"{descripcion}: coincidencia con la referencia de {fila['coincidencia_politica']:.3f} "
+                               f"frente a {base['coincidencia_politica']:.3f}")
+    return regresiones
+
+
+if __name__ == '__main__':
+    # MODIFICAR ESTOS VALORES PARA LANZAR LA COMPARACIÓN ##############################################
+    # 'suite' ejecuta todos los algoritmos en todas las instancias, 'trazas', 'dyna', 'arranque', 'hibrido'
+    # y 'asincrono' las comparaciones concretas
+    comparacion = 'suite'
+    archivo_json = './instancias-complejas/100x100-big_halls_of_moria.json'
+    semillas = [0, 1, 2]
+    max_episodios = 2000
+    max_pasos = 20000
+
+    # Instancias y número de procesos del escalado de QLearning asíncrono, el primero es la referencia de la aceleración
+    instancias_asincrono = ['./instancias-complejas/100x100-big_halls_of_moria.json',
+                            './instancias-complejas/500x500-ultimate_showdown_of_destiny.json']
+    lista_procesos = sorted({1, 2, 4, os.cpu_count()})
+
+    directorios_instancias = ['./initial-rl-instances', './instancias-complejas']
+    semillas_suite = [0]
+    # Los resultados se comparan con la referencia, que debe existir salvo que se esté creando con
+    # guardar_como_referencia = True (los tiempos dependen de la máquina, así que cada una tiene la suya)
+    archivo_referencia = 'referencia_benchmark.json'
+    guardar_como_referencia = False
+    archivo_resultados = 'resultados_benchmark.csv'
+    ###################################################################################################
+
+    if comparacion == 'suite':
+        if not guardar_como_referencia and not os.path.exists(archivo_referencia):
+            raise SystemExit(f"No existe la referencia {archivo_referencia}, ejecuta la suite con "
+                             f"guardar_como_referencia = True para crearla")
+        resultados = ejecutar_suite(listar_instancias(directorios_instancias), semillas_suite)
+        resultados.to_csv(archivo_resultados, index=False)
+        print(resultados.to_string(index=False))
+        if guardar_como_referencia:
+            guardar_referencia(resultados, archivo_referencia)
+            print(f"Referencia guardada en {archivo_referencia}")
+        else:
+            regresiones = comparar_con_referencia(resultados, archivo_referencia)
+            if regresiones:
+                raise SystemExit("REGRESIONES RESPECTO A LA REFERENCIA:\n" + "\n".join(regresiones))
+            print(f"Sin regresiones respecto a {archivo_referencia}")
+    elif comparacion == 'trazas':
+        print(comparar_trazas(archivo_json, semillas, max_episodios, max_pasos).to_string(index=False))
+    elif comparacion == 'dyna':
+        print(comparar_dyna(archivo_json, semillas, max_episodios, max_pasos).to_string(index=False))
+    elif comparacion == 'hibrido':
+        print(comparar_hibrido(archivo_json, semillas, max_episodios, max_pasos).to_string(index=False))
+    elif comparacion == 'asincrono':
+        print(comparar_asincrono(instancias_asincrono, lista_procesos, semillas, max_episodios,
+                                 max_pasos).to_string(index=False))
+    else:
+        print(comparar_arranque(archivo_json, semillas, max_episodios, max_pasos).to_string(index=False))
@@ -9,21 +9,25 @@ import re
 # METHOD DEFINITION
 # (You can directly import the method to use it)
 
-def draw_policy_map(problem_path, policy=None, save_to_file=True):
-    """
-    Draws the specified problem and the learned policy for visualization. 
+# Cell codes of the problem matrix, also used as indices of the color map:
+# 0 - Free - White
+# 1 - Blocked - Black
+# 2 - Dangers - Red
+# 3 - Departure - Green
+# 4 - Trapped - Blue
+# 5 - Fatal danger - Orange
+FREE, BLOCKED, DANGER, DEPARTURE, TRAPPED, FATAL_DANGER = range(6)
 
-    Policy is expected to follow the following format:
-    - A dictionary where each key (x, y) contains an action
+# Actions in the order of their indices in a policy array
+ACTIONS = ["UP", "RIGHT", "DOWN", "LEFT"]
 
-    Actions are expected to be given in the format <"up", "right", "down", "left>
-    (as strings)
 
-    If save_to_file is True, a PNG file with the problem name will be stored in the
-    current directory
+def read_problem(problem_path):
+    """
+    Reads the problem JSON and returns the arrays used by draw_policy_grid:
+    - The problem matrix with the code of each cell
+    - A matrix with the reward of each trapped and fatal danger cell (NaN elsewhere)
     """
-
-    # STEP 1 - PLOT THE PROBLEM
 
     # Read the problem path and store it as a dictionary
     with open(problem_path, "r") as file:
@@ -37,60 +41,146 @@ def draw_policy_map(problem_path, policy=None, save_to_file=True):
     trapped = problem_dict["trapped"]
     fatal_dangers = problem_dict["fatal_dangers"]
 
-    # Create the x/y tick labels and their positions
-    xticks_labels = np.arange(0, ncols, 1)
-    xticks = xticks_labels + 0.5
-
-    yticks_labels = np.arange(0, nrows, 1)
-    yticks = yticks_labels + 0.5
-
-    # Draw the matrix with the following colors:
-    # 0 - Free - White
-    # 1 - Blocked - Black
-    # 2 - Dangers - Red
-    # 3 - Departure - Green
-    # 4 - Trapped - Blue
-    # 5 - Fatal danger - Orange
     problem_matrix = np.zeros((nrows, ncols), int)
+    rewards = np.full((nrows, ncols), np.nan)
 
     # *blocked "separates" all elements of the list and feeds them one by one to zip
     # This extracts all [[x1, y1], [x2, y2]...] values into two lists: (x1, x2...) and (y1, y2...)
     if blocked:
         x_blocked, y_blocked = zip(*blocked)
-        problem_matrix[x_blocked, y_blocked] = 1
+        problem_matrix[x_blocked, y_blocked] = BLOCKED
 
     if dangers:
         x_dangers, y_dangers = zip(*dangers)
-        problem_matrix[x_dangers, y_dangers] = 2
+        problem_matrix[x_dangers, y_dangers] = DANGER
 
     # Departure can directly be uncoupled
     x_departure, y_departure = departure
-    problem_matrix[x_departure, y_departure] = 3
+    problem_matrix[x_departure, y_departure] = DEPARTURE
 
     # Trapped and fatal dangers have an additional reward - we can store it separately
     x_trapped, y_trapped, reward_trapped = zip(*trapped)
-    problem_matrix[x_trapped, y_trapped] = 4
+    problem_matrix[x_trapped, y_trapped] = TRAPPED
+    rewards[x_trapped, y_trapped] = reward_trapped
 
     if fatal_dangers:
         x_fatal_dangers, y_fatal_dangers, reward_fatal_dangers = zip(*fatal_dangers)
-        problem_matrix[x_fatal_dangers, y_fatal_dangers] = 5
+        problem_matrix[x_fatal_dangers, y_fatal_dangers] = FATAL_DANGER
+        rewards[x_fatal_dangers, y_fatal_dangers] = reward_fatal_dangers
 
-    # Create the original figure
-    plt.figure(figsize=(nrows, ncols))
-    ax = plt.gca()
+    return problem_matrix, rewards
 
-    # Create a color map for the city and plot it
-    cmap = ListedColormap(["white", "black", "red", "green", "blue", "orange"])
-    plt.pcolor(problem_matrix, cmap=cmap, edgecolors="k", vmin=0, vmax=5)
 
-    # Invert the Y axis and set up the ticks properly
-    ax.invert_yaxis()
+def draw_policy_map(problem_path, policy=None, save_to_file=True, max_figsize=20, max_labels=2500,
+                    downsample=None, tile_size=None):
+    """
+    Draws the specified problem and the learned policy for visualization. 
 
-    ax.set_xticks(xticks)
-    ax.set_xticklabels(xticks_labels)
+    Policy is expected to follow the following format:
+    - A dictionary where each key (x, y) contains an action
 
-    ax.set_yticks(yticks)
-    ax.set_yticklabels(yticks_labels)
+    Actions are expected to be given in the format <"up", "right", "down", "left>
+    (as strings)
+
+    If save_to_file is True, a PNG file with the problem name will be stored in the
+    current directory
+
+    The rest of the arguments are described in draw_policy_grid, which does the drawing
+    """
+
+    problem_matrix, rewards = read_problem(problem_path)
+
+    # Note - policy is a Python dictionary
+    # It is converted to an array with the index of the action of each cell (-1 if none)
+    policy_array = None
+    if policy:
+        policy_array = np.full(problem_matrix.shape, -1)
+        for (x, y), action in policy.items():
+            policy_array[x, y] = ACTIONS.index(str.upper(action))
+
+    # Extract the file name
+    file_name = os.path.splitext(os.path.basename(problem_path))[0]
+
+    draw_policy_grid(problem_matrix, policy_array, rewards, file_name, save_to_file, max_figsize, max_labels,
+                     downsample, tile_size)
+
+
+def is_interactive_backend():
+    """
+    Returns True if the current matplotlib backend can open a window, using the list of
+    non-interactive backends of matplotlib (Agg, PDF, SVG, Cairo...)
+    """
+    try:
+        from matplotlib.backends import backend_registry, BackendFilter
+        non_interactive = backend_registry.list_builtin(BackendFilter.NON_INTERACTIVE)
+    except ImportError:
+        # Matplotlib older than 3.9
+        from matplotlib import rcsetup
+        non_interactive = rcsetup.non_interactive_bk
+    return plt.get_backend().lower() not in non_interactive
+
+
+def draw_policy_grid(problem_matrix, policy=None, rewards=None, file_name="image", save_to_file=True,
+                     max_figsize=20, max_labels=2500, downsample=None, tile_size=None):
+    """
+    Draws a problem and a policy already stored in arrays, without reading any file.
+    This is the method to use when the problem is already loaded (e.g. plotting during
+    training or parameter sweeps).
+
+    - problem_matrix is a (rows, columns) matrix with the code of each cell (see the
+      constants at the top of this file)
+    - policy is a (rows, columns) matrix with the index of the action of each cell in
+      ACTIONS, or -1 if no arrow must be drawn in that cell
+    - rewards is a (rows, columns) matrix with the reward shown in the trapped and
+      fatal danger cells
+
+    If save_to_file is True, a PNG file named file_name will be stored in the current
+    directory
+
+    The map is drawn as a single image and all the arrows with a single quiver call,
+    so large maps can be rendered:
+    - max_figsize caps the largest side of the figure (in inches)
+    - Cell grid, tick labels and reward labels are only drawn when the map has at
+      most max_labels cells
+    - downsample=k only draws every k-th row and column (the map keeps its coordinates)
+    - tile_size=n additionally stores the map as n x n cell tiles,
+      named <file_name>_<row>_<column>.png after the first cell of each tile
+
+    When running with a non-interactive backend (e.g. Agg or PDF) the figure is not shown
+    """
+
+    # STEP 1 - PLOT THE PROBLEM
+    nrows, ncols = problem_matrix.shape
+
+    # Create the original figure, one inch per cell unless the map is larger than max_figsize
+    cell_size = min(1.0, max_figsize / max(nrows, ncols))
+    plt.figure(figsize=(ncols * cell_size, nrows * cell_size))
+    ax = plt.gca()
+    step = downsample or 1
+    small_map = nrows * ncols <= max_labels
+
+    # Create a color map for the city and plot it as a single image
+    # The extent keeps the cell (x, y) in the square [y, y + 1] x [x, x + 1], with the Y axis inverted
+    # When downsampling, each shown cell covers step x step cells, so the last row and column of the
+    # image may go beyond the map if its size is not a multiple of step
+    cmap = ListedColormap(["white", "black", "red", "green", "blue", "orange"])
+    shown_rows = -(-nrows // step) * step
+    shown_cols = -(-ncols // step) * step
+    plt.imshow(problem_matrix[::step, ::step], cmap=cmap, vmin=0, vmax=5, interpolation="nearest",
+               extent=(0, shown_cols, shown_rows, 0))
+
+    # Set up the ticks properly and the cell edges, only on small maps
+    if small_map:
+        xticks_labels = np.arange(0, ncols, 1)
+        yticks_labels = np.arange(0, nrows, 1)
+        ax.set_xticks(xticks_labels + 0.5)
+        ax.set_xticklabels(xticks_labels)
+        ax.set_yticks(yticks_labels + 0.5)
+        ax.set_yticklabels(yticks_labels)
+        ax.set_xticks(np.arange(0, ncols + 1), minor=True)
+        ax.set_yticks(np.arange(0, nrows + 1), minor=True)
+        ax.grid(which="minor", color="k")
+        ax.tick_params(which="minor", length=0)
 
     # Display the x-axis ticks at the top
     ax.tick_params(axis = "x",
@@ -101,49 +191,43 @@ def draw_policy_map(problem_path, policy=None, save_to_file=True):
                    labeltop = True)
 
     # STEP 2 - Draw the rewards
-    # Trapped rewards
-    for x, y, reward in zip(x_trapped, y_trapped, reward_trapped):
-        plt.text(x=y + 0.5, y=x + 0.5, s=f"+{reward}", 
-                 c="white", size=12, 
-                 horizontalalignment="center",
-                 verticalalignment="center")
-
-    # Fatal dangers penalties
-    if fatal_dangers:
-        for x, y, reward in zip(x_fatal_dangers, y_fatal_dangers, reward_fatal_dangers):
-            plt.text(x=y + 0.5, y=x + 0.5, s=str(reward), 
+    # Only drawn on small maps, one text per cell is too slow otherwise
+    if small_map and rewards is not None:
+        # Trapped rewards
+        for x, y in np.argwhere(problem_matrix == TRAPPED):
+            plt.text(x=y + 0.5, y=x + 0.5, s=f"{rewards[x, y]:+g}", 
+                     c="white", size=12, 
+                     horizontalalignment="center",
+                     verticalalignment="center")
+
+        # Fatal dangers penalties
+        for x, y in np.argwhere(problem_matrix == FATAL_DANGER):
+            plt.text(x=y + 0.5, y=x + 0.5, s=f"{rewards[x, y]:g}", 
                      size=12, 
                      horizontalalignment="center",
                      verticalalignment="center")
 
     # STEP 3 - Draw the policy
     # Only drawn if a policy is specified
-    if policy:
-        # Define the values to increment for drawing the arrows
-        increments = {"UP": (0.5, 0.75, 0.5, 0.25),
-                    "RIGHT": (0.25, 0.5, 0.75, 0.5), 
-                    "DOWN": (0.5, 0.25, 0.5, 0.75), 
-                    "LEFT": (0.75, 0.5, 0.25, 0.5)}
-
-        # Loop through all the policies
-        # Note - policy is a Python dictionary
-        # You need to pre-process it before using the method
-        for (x, y), action in policy.items():
-
-            # Extract the information
-            action = str.upper(action)
-            a, b, c, d = increments[action]
-            xytext= (y + a, x + b)
-            xy = (y + c, x + d)
-            plt.annotate("", xy= xy, xytext=xytext, arrowprops={"arrowstyle": "->"})
+    if policy is not None:
+        # Direction of the arrow of each action as (column, row) increments, in the order of ACTIONS
+        increments = np.array([(0, -1), (1, 0), (0, 1), (-1, 0)])
+
+        # All the arrows are drawn at once, centered in their cell and half a cell long
+        shown_policy = policy[::step, ::step]
+        x, y = np.nonzero(shown_policy >= 0)
+        directions = increments[shown_policy[x, y]]
+        plt.quiver(y * step + 0.5 * step, x * step + 0.5 * step,
+                   directions[:, 0] * 0.5 * step, directions[:, 1] * 0.5 * step,
+                   angles="xy", scale_units="xy", scale=1, pivot="mid", units="xy", width=0.04 * step)
 
     # Show the image and, if necessary, store it
     fig = plt.gcf()
 
-    plt.show(block=False)
+    interactive = is_interactive_backend()
+    if interactive:
+        plt.show(block=False)
     if save_to_file:
-        # Extract the file name
-        file_name = os.path.splitext(os.path.basename(problem_path))[0]
         # Sanity check - if the file name is empty, give it a default name
         if not file_name:
             file_name = "image"
@@ -151,6 +235,19 @@ def draw_policy_map(problem_path, policy=None, save_to_file=True):
         # Save the image
         fig.savefig(file_name + ".png", bbox_inches = "tight")
 
+        # Save the tiles, moving the visible area of the same figure
+        if tile_size:
+            tile_inches = min(tile_size, max_figsize)
+            fig.set_size_inches(tile_inches, tile_inches)
+            for row in range(0, nrows, tile_size):
+                for column in range(0, ncols, tile_size):
+                    ax.set_xlim(column, min(column + tile_size, ncols))
+                    ax.set_ylim(min(row + tile_size, nrows), row)
+                    fig.savefig(f"{file_name}_{row}_{column}.png", bbox_inches = "tight")
+
+    # Without a window the figure is not needed anymore
+    if not interactive:
+        plt.close(fig)
 
 
 # ACCESS POINT